@@ -1,13 +1,21 @@
 # Importing necessary libraries
 import streamlit as st
 import pandas as pd
-import matplotlib.pyplot as plt
-import plotly.express as px
-import plotly.graph_objs as go
-import seaborn as sns
-import re
 import numpy as np
-import time
+
+from categorizer import reload_rules
+from charts import SCATTER_POINTS, cached_line_points, cached_scatter_voxels, ripple_surface
+from instrumentation import Stage, StageLog, enable_stage_logging
+from indexes import row_count, transaction_index
+from pipeline import DIRECTIONS, append_statements, filter_state_rows, sorted_page
+from rollups import cached_row_totals, rollup_cube
+from search import search_index
+
+# Sessions share enriched frames through shallow copies (see
+# pipeline.append_statements); with copy-on-write, the only mode from pandas 3
+# on, writing to a copy copies its data first instead of changing the shared frame
+if int(pd.__version__.split('.')[0]) < 3:
+    pd.set_option('mode.copy_on_write', True)
 
 # Page configuration
 st.set_page_config(
@@ -114,63 +122,70 @@ if st.session_state.show_documentation:
         </style>
     ''', unsafe_allow_html=True)
 
-# Caching data loading function
-@st.cache_data
-def load_df():
-    file_path = 'merged_data.csv'
-    return pd.read_csv(file_path)
-
-data = load_df()
-
-# Cleaning data
-def process_data(df):
-    # Formatting column names
-    df.columns = (df.columns.str.replace(' ', '_')
-                              .str.replace('-', '_')
-                              .str.replace('/', '_')
-                              .str.replace('.', '')
-                              .str.lower())
-
-    # Check and replace '/' in dates if present
-    date_columns = ['transaction_date', 'value_date']
-    for col in date_columns:
-        if df[col].str.contains('/').any():
-            df[col] = df[col].str.replace('/', '-')
-
-    # Formatting dates
-    for col in date_columns:
-        try:
-            df[col] = pd.to_datetime(df[col], format='%d-%m-%Y')
-            
-        except ValueError:
-            st.warning(f"Error parsing dates in column {col}. Ensure dates are in 'dd-mm-yyyy' format.")
-            return None
-
-    # Splitting and mapping transaction details as boolean values
-    try:
-        df[['transaction_type', 'transaction_number']] = df['chq___ref_no'].str.split('-', expand=True)
-    except KeyError:
-        st.error("Column 'chq___ref_no' not found in the dataframe.")
-        return None
+# Statements analysed by the app: a CSV export, a directory of exports or a
+# glob pattern such as 'statements/*.csv'
+STATEMENT_SOURCE = 'merged_data.csv'
 
-    # Mapping 'dr___cr' to numerical values
-    mapping = {'CR': 1, 'DR': -1}
-    df['credit_debit_value'] = df['dr___cr'].map(mapping).fillna(0)
+# Rows per page of the transaction table offered, and the default
+TABLE_PAGE_SIZES = [50, 100, 250, 500, 1000]
+TABLE_PAGE_SIZE = 100
 
-    # Adjusting net balance
+# Enriched statements and their dataset key (see pipeline.append_statements),
+# kept in memory between reruns and shared by every session without copying
+# them; rows appended to the exports since the last rerun are enriched alone.
+# Each session gets a shallow copy that pandas copies on write; views are
+# taken by position
+def load_enriched_data(source):
     try:
-        df['net_balance'] = df['balance'] * df['credit_debit_value']
-    except KeyError:
-        st.error("Column 'balance' not found in the dataframe.")
-        return None
+        return append_statements(source)
+    except (OSError, ValueError) as error:
+        st.warning(str(error))
+        return None, None
 
-    return df
+# Stages of a rerun tracked by the sidebar progress bar, in the order they run
+PROGRESS_STAGES = ['load', 'filtering', 'styling', 'line_chart', 'scatter_3d', 'category_chart', 'names_chart', 'parallel_categories', 'csv_export']
 
-# Apply the processing function to the data
-data = process_data(data)
+st.sidebar.markdown('<h1 class="sidebar-title">Report Configuration</h1>', unsafe_allow_html=True)
+
+with st.sidebar:
+    # Add a placeholder for the status message
+    status_message = st.empty()
+    status_message.caption('Computing transactions...')
+    
+    # Add a placeholder for the iteration text
+    latest_iteration = st.empty()
+    bar = st.progress(0)
+
+# Advance the progress bar as the tracked stages finish
+#
+# Untracked stages run inside the cached load_enriched_data, which Streamlit
+# replays on a cache hit; it cannot replay writes to the sidebar elements
+# created here, so those stages leave the sidebar alone.
+def show_progress(record):
+    if record['stage'] not in PROGRESS_STAGES:
+        return
+    percent = 100 * (PROGRESS_STAGES.index(record['stage']) + 1) // len(PROGRESS_STAGES)
+    latest_iteration.text(f'{percent}%')
+    bar.progress(percent)
+    status_message.caption(f"Computing transactions... {record['stage']} done")
+
+# Stage timings of this rerun, also logged as JSON lines to stderr
+enable_stage_logging()
+timings = StageLog(on_stage=show_progress).activate()
+
+with Stage('load') as load:
+    # Pick up edits to the rule files since the last rerun
+    try:
+        reload_rules()
+    except (OSError, ValueError) as error:
+        st.warning(f"Rule files could not be reloaded, keeping the previous rules. {error}")
+
+    statement_key, data = load_enriched_data(STATEMENT_SOURCE)
+    load.rows_out = 0 if data is None else len(data)
 
 if data is None:
     st.error("Data processing failed. Please check the input data and try again.")
+    st.stop()
 
 st.divider()
 # Streamlit app
@@ -182,327 +197,26 @@ def main():
         ['Credit', 'Debit', 'Both']
     )
     
-    # Determine which values to set based on selection
-    if 'Both' in transaction_types:
-        toggle_values = [1, -1]
-    elif 'Credit' in transaction_types:
-        toggle_values = [1]
-    elif 'Debit' in transaction_types:
-        toggle_values = [-1]
-    else:
-        toggle_values = []
-
-    # Update DataFrame based on selected values
-    if 'Both' in transaction_types:
-        data['credit_debit_value'] = data['credit_debit_value'].apply(lambda x: x if x in toggle_values else None)
-    else:
-        data['credit_debit_value'] = data['credit_debit_value'].apply(lambda x: x if x in toggle_values else None)
-
-if __name__ == "__main__":
-    main()
-
-
-def extract_name(description):
-    # Define regex patterns
-    slash_pattern = re.compile(r'/([A-Za-z\s]+?)/')
-    embedded_pattern = re.compile(r'([A-Za-z]+(?:\s[A-Za-z]+)+)')
-    specific_pattern = re.compile(r'SentIMPS\d+(\w+)\b')
-    youtube_pattern = re.compile(r'\b(?:sold by\s+)?youtube\b', re.IGNORECASE)
-    debit_card_pattern = re.compile(
-        r'\b(?:DEBIT CARD ANNUAL FEE \w{4}\d{4} FOR \d{4}|'
-        r'Chrg: Debit Card Annual Fee \d{4} For \d{4}|'
-        r'Rem Chrgs:Debit Card Annual Fee \d{4} For \d{4}|'
-        r'UPI/\w+/[\d\/]+/Debit Money Usi|'
-        r'Ins Debit A\\c SPLN \d+ dt \d{2}/\d{2}/\d{2,4}|'
-        r'Ins Debit A\\c PDL \d+ dt \d{2}/\d{2}/\d{2,4})', re.IGNORECASE
-    )
-    name_pattern = re.compile(r'\b[A-Z][a-z]+(?: [A-Z][a-z]+)*\b')
-    cognizant_pattern = re.compile(r'\bCOGNIZANT\b|\bCOGNIZ.*?\b', re.IGNORECASE)
-    amazon_pattern = re.compile(
-        r'\b(?:UPI/amazon(?:@apl|\.refu)?/\d+/.*|'
-        r'PCD/1186/(?:WWW\s)?AMAZON\s(?:IN|Seller\sServices|Pay)|'
-        r'PG\sAMAZON\sPAY\sINDIA\sPRI|'
-        r'UPI/Amazon\s(?:India|Prime\sRe(?:fund)?|Seller\sServices|Pay|Package)|'
-        r'UPI/AMAZON\sSELLER\sS(?:\s|/|UPI|MB\sUPI)?|'
-        r'UPI/AMAZON(?:\sSELLER\sS)?(?:/|UPI|MB\sUPI)?|'
-        r'PCD/1186/Amazon\s(?:Seller\sServices|Pay)|'
-        r'UPI/Amazon\s(?:India|Prime\sRe(?:fund)?)|'
-        r'UPI/AMAZON\s(?:SELLER\sS|SELLER\sS\s(?:UPI|MB\sUPI))\b'
-        r')',
-        re.IGNORECASE
-    )
-
-    # Try to find names with the Amazon pattern first
-    amazon_match = amazon_pattern.search(description)
-    if amazon_match:
-        extracted_name = 'Amazon'
-    else:
-        # Try to find names with the Cognizant pattern
-        cognizant_match = cognizant_pattern.search(description)
-        if cognizant_match:
-            extracted_name = cognizant_match.group(0).title()
-        else:
-            # Check for YouTube patterns
-            youtube_match = youtube_pattern.search(description)
-            if youtube_match:
-                extracted_name = youtube_match.group(0).title()
-            else:
-                # Check for debit card patterns
-                debit_card_match = debit_card_pattern.search(description)
-                if debit_card_match:
-                    extracted_name = debit_card_match.group(0)
-                else:
-                    # If no matches with debit card pattern, try to find names enclosed by slashes
-                    slash_matches = slash_pattern.findall(description)
-                    if slash_matches:
-                        extracted_name = slash_matches[0].title()
-                    else:
-                        # If no matches with slashes, try to find names with specific patterns
-                        specific_matches = specific_pattern.findall(description)
-                        if specific_matches:
-                            extracted_name = specific_matches[0].title()
-                        else:
-                            # If no matches with specific patterns, try to find names with the name pattern
-                            name_matches = name_pattern.findall(description)
-                            if name_matches:
-                                extracted_name = name_matches[0].title()
-                            else:
-                                # If no matches with name pattern, try to find embedded names
-                                embedded_matches = embedded_pattern.findall(description)
-                                extracted_name = embedded_matches[0].title() if embedded_matches else 'Other'
-
-    # Categorize the extracted name
-    categorized_name = categorize_name(extracted_name)
-    return categorized_name if categorized_name != 'Other' else extracted_name
-
-# Define the categorize_names function
-def categorize_name(extracted_name):
-    patterns = {
-        'Vyom': r'\b(vyomdeepans|vyom|vyom deepansh|8447156697|9958121100|fd booked|rd booked|vyomdeepansh-1)\b',
-        'Kanishq Sharma': r'\b(muzicmapass|kanishq(?: sharma)?|kan|9873683245|8433204684)\b',
-        'Kasturi Sharma': r'(?i)\b(kast(?:oori(?:sharma)?|oorisha)?|8789816580|KASTURI SHAR)\b',
-        'Ajay Sharma': r'\b(ajay sharma|9833640145)\b',
-        'Deepak Vishwakarma': r'\b(deepak (?:vishwakarma|kumar vi))\b',
-        'Anandita Jangra': r'\b(anandita(?: jangra)?|8979655500|ananditajangra1)\b',
-        'Dhruv Parashar': r'\b(dhruv parashar)\b',
-        'Karanveer': r'\b(karancr8999|karanveer|971585216969|9646862136)\b',
-        'Karan Talwar': r'\b(karan talwar)\b',
-        'Pragun Magan': r'\b(pragun magan|8447783423)\b',
-        'Yawar Rashid': r'\b(yawar rashid|9956394027)\b',
-        'Hitesh Bhagat': r'\b(hitesh(?: bhagat|bhaga)?|hit|ICICX5879|8447299009)\b',
-        'Akhriebu Pucho': r'\b(akhriebu(?: pucho)?|9582384807)\b',
-        'Bhupesh Jingar': r'\b(bhupesh jingar|darsh jing|ICICX7180)\b',
-        'Vivek Tanti': r'\b(vivek(?: tanti|tanti5)?|9172603649)\b',
-        'Vishal Tanti': r'\b(vishal(?: tanti|tanti|\.tant)?|UTIBX8285|9774973923)\b',
-        'Gaurav Yadav': r'\b(1993ygaurav|Gaurav Yadav)\b',
-        'Jegendra': r'\b(jegendermn7)\b',
-        'Parth Singh': r'\b(parth singh|9910270502)\b',
-        
-        'Dominos': r'\b(dominos)\b',
-        'Bagril Biotech': r'(bagril)',
-        'Balaji Store': r'balaji|bala ji',
-        'Cognizant': r'\bCOGNIZANT\b|\bCOGNIZ.*?\b',
-        'Zomato': r'\bZomato\b(?: Media Pr| Ltd)?',
-        'Amazon': r'\amazon|amazon@apl|you are pay|amazon india|amazon pay|amazon seller\b',
-        'Rento Mojo': r'\b(edunetwork|rento|rentomojo|rentomojorazorp|rentomojorentpa)\b',
-        'DBHVN': r'\b(dakshin|dbhvn)\b',
-        'Bookmyshow': r'\b(bookmyshow)\b',
-        'Makemytrip': r'\b(makemytrip)\b',
-        'Flipkart': r'\b(flipka|flipkart)\b',
-        'Swiggy': r'\b(swiggy)\b',
-        'Blinkit': r'\b(grofers|blinkit)\b',
-        'Licious': r'\b(licious)\b',
-        'Vendiman': r'vendiman(?: pvt ltd)?',
-
-        'Airtel': r'\b(airtel|bharti|BhartiAirte)\b',
-        'Aditya Birla': r'\b(aditya birla fa|ABFL)\b',
-        'Uber': r'\b(uberrides|uber)\b',
-        'Ola': r'\bola\s+(money|financial)\b',
-        'Netflix': r'\bnetflix(?:\scom)?\b',
-        'YouTube': r'\b(?:sold by\s+youtube|youtube(?:\s?prem)?)\b',
-        'Google': r'\b(google india di)\b',
-        'Paytm Wallet': r'\b(payt|add-money)\b',
-        'Personal Loan': r'\b(SPLN|PDL)\b',
-        'Kotak': r'\bchr?gs?|annual fee|cw fee\b',
-    }
-    
-    for category, pattern in patterns.items():
-        if re.search(pattern, extracted_name, re.IGNORECASE):
-            return category
-    return 'Other'
-
-# Define the categorize_brands function
-def categorize_brands(extracted_name):
-    name = extract_name(extracted_name)
-    if name == 'Other':
-        patterns = {
-            
-        }
-        for category, pattern in patterns.items():
-            if re.search(pattern, description, re.IGNORECASE):
-                return category
-        return 'Other'
-    else:
-        return name
-
-def categorize_buckets(name):
-    name = extract_name(name)
-    patterns = {
-        'Self': r'\b(vyomdeepans|vyom|vyom deepansh|8447156697|fd booked|rd booked)\b',
-        'Family': r'\b(muzicmapass|kanishq|kanishq sharma|kan |kast |kastoorisha|kastoori|kasturi|deepak vi|deepak kumar vi)\b',
-        'Friends': r'\b(ananditajangra1|anandita|vivek|vivektanti5|vishal|tanti|hites|bhaga)\b',
-        'Utilities': r'\b(bharti|airtel|paytmairtelrecharge|dakshin|dbhvn|rento|mojo|airtelin|airtelrecharge)\b',
-        'Misc': r'\b(thapa|ricky)\b',
-        'Fuel': r'\b(?:Hpcl Auto Care Center|Auto Care Centre Hpcl|Fuel Junction|Gupta Service Station|Enroute Sahays Filling|City Fuels|Jawala Service Station|Spr Petro|Rama Filling Station|M S Suraj Auto|Meer Singh Fuel Point|Navyug Fuels|Shree Shyam Petro|Petro Mall|Dhruvika Petro|H P Hira Fuels|Infinity Fuels|Pauls Petro Mar|Raghunandan Filling St|Rama Filling St|Meer Singh Fuel|Hello Fuels)\b',
-        'Groceries': r'\b(?:grofers|fast\s*n\s*fresh|sandeep|bala ji|balaji\s*(?:super|distribu)?|vandanachawla|7015758745)\b',
-        'ATM Withdrawal': r'\b(atm|card)\b',
-        'Salary Credit': r'\b(rcvd|cognizant|fis)\b',
-        'Ecommerce': r'\b(amazon|flipk|kart)\b',
-        'Liquor': r'\b(?:LIQUOR|WINE|WINES|WINE & BEER|LIQUORLAND|VINTAGE WINES|LAKE FOREST WINES|DISCOVERY LIQUOR|ABOHAR LIQUOR|SHIVAM WINES|G TOWN WINES|TIME FOR WINE)\b',
-        
-        'Loan': r'\b(loan|SPLN|Ins Debit)\b',
-        'House Rent': r'\b(bhupesh|darsh|jing|ICICX7180|landlord)\b',
-        'Trading': r'\b(nextbillion|groww)\b',
-        'Travel': r'\b(makemy|travel|bnb|oyo)\b',
-        'Movies': r'\b(bookmy|pvr|cinepolis|cinema|movi|ny cinemas)\b',
-        'Food': r'\b(9891020216|twenty four seven|foods|chick po|paan|dhaba|restaurant|food|food court|tea|zomato|the ducktales|vendiman)\b',
-    }
-    for category, pattern in patterns.items():
-        if re.search(pattern, name, re.IGNORECASE) or re.search(pattern, name, re.IGNORECASE):
-            return category
-    
-    # Check each pattern against the name
-    for category, pattern in patterns.items():
-        if re.search(pattern, name, re.IGNORECASE):
-            return category
-    
-    # If no match is found, return 'Other'
-    return 'Other'
-
-
-# Defining payment method categorization
-def categorize_payment_method(transaction_type):
-    patterns = {
-        'Immediate Payment Service [IMPS]': r'IMPS',
-        'National Electronic Funds Transfer [NEFT]': r'NEFT|KKBKH|MB|MOBILE BANKING|TBMS|PDL|SPLN',
-        'Unified Payments Interface [UPI]': r'UPI',
-        'Automated Teller Machine [ATM]': r'ATL|DEBIT|CARD|VISA',
-        'Point of Sale Card Transaction [PCD]': r'PCD',
-        }
-    for method, pattern in patterns.items():
-        if re.search(pattern, transaction_type):
-            return method
-    return 'Other'
-
-# Defining payment method categorization acronyms for visuals
-def categorize_payment_method_acronyms(description):
-    patterns = {
-        'IMPS': r'IMPS',
-        'NEFT': r'NEFT|MB|TBMS',
-        'UPI': r'UPI',
-        'ATM': r'ATM|DEBIT|CARD|VISA',
-        'PCD': r'PCD',
-    }
-    for method, pattern in patterns.items():
-        if re.search(pattern, description):
-            return method
-    return 'Other'
-
-
-# Define the combined function
-def combined_function_name(description):
-    name = extract_name(description)
-    if name == 'Other':
-        name = categorize_name(description)  # Categorize the description as a name
-        if name == 'Other':
-            name = categorize_brands(description)  # Categorize the description as a brand
-    return name
-
-# Apply the combined function to the 'description' column
-data['transaction_names'] = data['description'].apply(combined_function_name)
-data['payment_method'] = data['description'].apply(categorize_payment_method)
-data['payment_method_acronym'] = data['description'].apply(categorize_payment_method_acronyms)
-data['transaction_category'] = data['transaction_names'].apply(categorize_buckets)
-
-def clean_columns(data, columns):
-    for column in columns:
-        data[column] = data[column].str.replace(',', '')
-        data[column] = data[column].str.split('.').str[0]
-        data[column] = data[column].astype(int)
-    return data
-
-# Columns to be cleaned
-columns_to_clean = ['amount', 'balance']
-data = clean_columns(data, columns_to_clean)
-
-multiplier = 2
-bin_edges = [0]
-for i in range(1, 21):
-    next_edge = bin_edges[-1] * multiplier if bin_edges[-1] > 0 else 500
-    bin_edges.append(next_edge)
-
-bin_labels = [f"{int(bin_edges[i])}-{int(bin_edges[i+1])}" for i in range(len(bin_edges)-1)]
-
-# Create the balance_category column
-data['balance_category'] = pd.cut(data['balance'], bins=bin_edges, labels=bin_labels, right=False)
-
-# Create a mapping dictionary from labels to numerical values
-label_mapping = {label: i for i, label in enumerate(bin_labels)}
-
-# Map the balance_category to numerical values
-data['balance_category_num'] = data['balance_category'].map(label_mapping)
-
-bin_edges = [0]
-for i in range(1, 21):
-    next_edge = bin_edges[-1] * multiplier if bin_edges[-1] > 0 else 500
-    bin_edges.append(next_edge)
-
-bin_labels = [f"{int(bin_edges[i])}-{int(bin_edges[i+1])}" for i in range(len(bin_edges)-1)]
-
-# Create the balance_category column
-data['amount_category'] = pd.cut(data['amount'], bins=bin_edges, labels=bin_labels, right=False)
-
-# Create a mapping dictionary from labels to numerical values
-label_mapping = {label: i for i, label in enumerate(bin_labels)}
-
-# Map the balance_category to numerical values
-data['amount_category_num'] = data['amount_category'].map(label_mapping)
-
-# Extract year and month and create a categorical column in the desired format
-data['transaction_month'] = data['transaction_date'].dt.strftime('%b %Y')  # Format: 'Apr 2023'
-data['transaction_year'] = data['transaction_date'].dt.strftime('%Y')  # Format: '2023'
-
-# Optionally, you can sort and see the data
-data.sort_values(by='transaction_date', inplace=True)
-
-data['transaction_date'].nunique()
-
-st.sidebar.markdown('<h1 class="sidebar-title">Report Configuration</h1>', unsafe_allow_html=True)
+    # Credits (1) or debits (-1) only, or None for every transaction
+    if 'Both' in transaction_types or len(transaction_types) != 1:
+        return None
+    return DIRECTIONS[transaction_types[0]]
 
-with st.sidebar:
-    # Add a placeholder for the status message
-    status_message = st.empty()
-    status_message.caption('Computing transactions...')
-    
-    # Add a placeholder for the iteration text
-    latest_iteration = st.empty()
-    bar = st.progress(0)
+# Credit/debit selection, filtered on with the dates, amount and balance below
+direction = main()
 
-    for i in range(100):
-        # Update the progress bar with each iteration
-        latest_iteration.text(f'{i+1}%')
-        bar.progress(i + 1)
-        time.sleep(0.01)
+# Filtering runs from the sliders down to filtered_data
+filtering = Stage('filtering', len(data))
 
-    # Update the status message to 'Done' after the loop
-    status_message.caption('Computation complete')
+# Sorted indexes for the sidebar filters, the word index for the search box
+# and the rollup cube for the distribution charts, built once per dataset
+# version and extended as rows are appended
+index = transaction_index(statement_key, data)
+search = search_index(statement_key, data)
+cube = rollup_cube(statement_key, data)
 
 # Date Range Slider
-max_start = data['transaction_date'].min()
-max_end = data['transaction_date'].max()
-
-# Calculate the number of days from the start date
-data['number_days'] = (data['transaction_date'] - max_start).dt.days + 1
+max_start, max_end = map(pd.Timestamp, index.indexes['transaction_date'].extent())
 
 # Convert max_start and max_end to days since max_start
 days_index_start = 0
@@ -528,8 +242,7 @@ end_date_str = end_date.strftime('%Y-%m-%d')
 col1, col2, col3 = st.columns([1, 1, 1])
 
 # Check if the selected dates are at their maximum values
-max_start_date = data['transaction_date'].min()
-max_end_date = data['transaction_date'].max()
+max_start_date, max_end_date = max_start, max_end
 
 start_date_color = "gray" if start_date == max_start_date else "white"
 end_date_color = "gray" if end_date == max_end_date else "white"
@@ -547,9 +260,6 @@ with col1:
 with col3:
     st.markdown(f'<p style="color:{end_date_color}; text-align: right;" title="The end date of the selected period">End Date: {end_date_str}</p>', unsafe_allow_html=True)
 
-# Filter transaction data based on the selected date range
-transaction_date_data = data[(data['transaction_date'] >= start_date) & (data['transaction_date'] <= end_date)]
-
 # Amount Slider
 min_amount = 0
 max_amount = 70000
@@ -562,45 +272,34 @@ slider_value_amount = st.sidebar.slider(
     value=(min_amount + max_amount) // 2  # Initial value in the middle
 )
 
-# Filter the transaction data based on the selected amount value
-filtered_1data = transaction_date_data[transaction_date_data['amount'] <= slider_value_amount]
-
 # Balance Slider
 min_balance = 0
 max_balance = 90000
 
 # Create a single seekbar handle for the amount range
-slider_value_amount = st.sidebar.slider(
+slider_value_balance = st.sidebar.slider(
     'Balance',
     min_value=min_balance,
     max_value=max_balance,
     value=(min_balance + max_balance) // 2  # Initial value in the middle
 )
 
-# Filter the transaction data based on the selected amount value
-amount_filtered_data = filtered_1data[filtered_1data['amount'] <= slider_value_amount]
-
-def search_transactions(keyword, amount_filtered_data):
-    # Convert keyword to lowercase for case-insensitive search
-    keyword = keyword.lower()
-    
-    # Filter the DataFrame based on the keyword
-    result = amount_filtered_data[
-        amount_filtered_data['description'].str.lower().str.contains(keyword) |
-        amount_filtered_data['transaction_names'].str.lower().str.contains(keyword) |
-        amount_filtered_data['transaction_category'].str.lower().str.contains(keyword)
-
-    ]
-    return result
-
 # Sidebar input for the search query
-keyword = st.sidebar.text_input("Please enter your query:")
+keyword = st.sidebar.text_input("Please enter your query:", help="Finds transactions with words starting with every word of the query, "
+                                "in their description, name or category. Put a word in double quotes to match it exactly.")
+fuzzy = st.sidebar.checkbox("Fuzzy search", help="Also finds truncated or misspelt descriptions and names, such as 'BhartiAirte' "
+                            "or 'swigy', ranked by how similar they are to the query.")
+
+# Rows left by the selected dates, amount, balance, direction and search, looked up by
+# filter state; the table keeps amounts within the amount slider's range and
+# the charts keep balances from the balance slider's minimum to the amount slider's maximum
+rows = filter_state_rows(statement_key, index, search, start_date, end_date, slider_value_amount, slider_value_balance,
+                         direction, keyword, fuzzy, (min_amount, max_amount), (min_balance, max_amount))
 
 # Display the search results
 if keyword:
-    results = search_transactions(keyword, amount_filtered_data)
-    num_results = len(results)  # Get the number of search results
-    if not results.empty:
+    num_results = row_count(rows.searched)  # Get the number of search results
+    if num_results:
         result_text = f"Search Results: {keyword} ({num_results} results)"
         result_color = "white"
     else:
@@ -608,76 +307,82 @@ if keyword:
         result_color = "grey"
 else:
     # Count the "Other" values in the entire 'transaction_names' column
-    unattributed_names = amount_filtered_data['transaction_names'].value_counts().get('Other', 0)
+    unattributed_names = (data['transaction_names'].iloc[rows.filtered] == 'Other').sum()
     
     result_text = f"Please enter a query to search for transactions | There are {unattributed_names} unattributed names"
     result_color = "gray"
 
 st.markdown(f'<p style="color:{result_color};">{result_text}</p>', unsafe_allow_html=True)
 
-name_filtered_data = search_transactions(keyword, amount_filtered_data)
-balance_filtered_data = name_filtered_data[(name_filtered_data['amount'] >= min_amount) & (name_filtered_data['amount'] <= max_amount)]
-
 # Dropping redundant columns
-columns_to_preview = ['number_days', 'value_date','net_balance','payment_method_acronym', 'sl_no', 'chq___ref_no', 'transaction_type', 'transaction_number', 'dr___cr', 'dr___cr1', 'transaction_number']
-columns_to_analyze = ['sl_no', 'transaction_number', 'dr___cr1', 'transaction_type']
+columns_to_preview = ['value_date','net_balance','payment_method_acronym', 'chq___ref_no', 'transaction_type', 'transaction_number', 'dr___cr', 'transaction_number', 'amount_paise', 'balance_paise', 'extracted_entity']
+columns_to_analyze = ['transaction_number', 'transaction_type', 'amount_paise', 'balance_paise', 'extracted_entity']
 
-visible_data = balance_filtered_data.drop(columns=columns_to_preview)
-processed_data = balance_filtered_data.drop(columns=columns_to_analyze)
+# The charts are drawn from the data by position
+filtered_data = data.iloc[rows.charts].drop(columns=columns_to_analyze)
 
-@st.cache_data
-def get_preview_data(visible_data, processed_data, balance_filtered_data, min_balance, max_amount):
-    return visible_data[(processed_data['balance'] >= min_balance) & (balance_filtered_data['balance'] <= max_amount)]
-
-preview_data = get_preview_data(visible_data, processed_data, balance_filtered_data, min_balance, max_amount)
-filtered_data = processed_data[(processed_data['balance'] >= min_balance) & (balance_filtered_data['balance'] <= max_amount)]
+# Calculate the number of days from the start date
+filtered_data['number_days'] = (filtered_data['transaction_date'] - max_start).dt.days + 1
+filtering.finish(len(filtered_data))
 
-# Function to create gradient based on transaction_date rank
-def color_date_gradient(val):
-    color = f'background-color: rgba(5, 50, 10, {val})'
-    return color
+styling = Stage('styling', row_count(rows.table))
 
-def apply_gradient_to_transaction_dates(dataframe):
-    def color_date_gradient(value):
-        return f'background: rgba(255, {int(255 * value)}, 0, 0.5)'
+# Table columns; fuzzy search results also show their similarity
+table_columns = [column for column in data.columns if column not in columns_to_preview]
+if rows.similarity is not None:
+    table_columns.append('similarity')
 
-    styled_data = dataframe.style.background_gradient(cmap='viridis')
-    styled_data = styled_data.apply(lambda x: x.rank(pct=True).apply(color_date_gradient), subset=['transaction_date'])
-    
-    return styled_data
+# Sort order and page of the table; fuzzy search results are listed most similar first
+col1, col2, col3, col4 = st.columns([2, 1, 1, 1])
+with col1:
+    sort_column = st.selectbox("Sort by", table_columns, index=len(table_columns) - 1 if rows.similarity is not None else 0)
+with col2:
+    sort_descending = st.checkbox("Descending", value=rows.similarity is not None)
+with col3:
+    page_size = st.selectbox("Rows per page", TABLE_PAGE_SIZES, index=TABLE_PAGE_SIZES.index(TABLE_PAGE_SIZE))
+table_rows = np.arange(rows.table.start, rows.table.stop) if isinstance(rows.table, slice) else rows.table
+page_count = max(1, -(-len(table_rows) // page_size))
+with col4:
+    page = st.number_input("Page", min_value=1, max_value=page_count, value=1, step=1)
+
+# Only the rows of the page are sorted, taken from the data and styled; rows
+# sort on keys precomputed per column (see indexes.TransactionIndex.sort_key)
+if sort_column == 'similarity':
+    sort_keys = np.unique(rows.similarity, return_inverse=True)[1]
+else:
+    sort_keys = index.sort_key(data, sort_column)[table_rows]
+on_page = sorted_page(sort_keys, min(page, page_count) - 1, page_size, sort_descending)
+visible_data = data.iloc[table_rows[on_page]].drop(columns=columns_to_preview)
+if rows.similarity is not None:
+    visible_data['similarity'] = rows.similarity[on_page]
 
-gradient_data = apply_gradient_to_transaction_dates(preview_data)
+# Function to apply color coding based on 'credit_debit_value': blue for credits, red for debits
+def color_credit_debit_amount(df):
+    colors = np.select([df['credit_debit_value'] == 1, df['credit_debit_value'] == -1], ['color: blue', 'color: red'], 'color: ')
 
-# Function to apply color coding based on 'credit_debit_value'
-def color_based_on_credit_debit(val, color_map):
-    return f'color: {color_map.get(val, "")}'
+    # The same colors apply to the 'credit_debit_value' and 'amount' columns
+    credit_debit_styles = pd.Series(colors, index=df.index)
+    amount_styles = credit_debit_styles
 
-# Define a function to color the 'amount' column based on the 'credit_debit_value'
-def color_credit_debit_amount(df):
-    # Create a color map based on 'credit_debit_value' column
-    color_map = {1: 'blue', -1: 'red'}
-    
-    # Apply color to 'credit_debit_value' column
-    credit_debit_styles = df['credit_debit_value'].map(lambda x: color_based_on_credit_debit(x, color_map))
-    
-    # Apply color to 'amount' column based on 'credit_debit_value' column
-    amount_styles = df['credit_debit_value'].map(lambda x: color_based_on_credit_debit(x, color_map))
-    
     return credit_debit_styles, amount_styles
 
 # Get the styles
 credit_debit_styles, amount_styles = color_credit_debit_amount(visible_data)
 
-# Create a copy of the DataFrame without the columns to be hidden
-visible_data_styled = visible_data.copy()
-
 # Apply the styles
-styled_data = (visible_data_styled.style
+styled_data = (visible_data.style
                 .apply(lambda x: credit_debit_styles, subset=['credit_debit_value'])
                 .apply(lambda x: amount_styles, subset=['amount']))
 
-# Display the styled DataFrame
+# Display the styled page of the DataFrame
 st.dataframe(styled_data, hide_index=True)
+page_start = (min(page, page_count) - 1) * page_size
+st.caption(f"Rows {page_start + 1}-{page_start + len(visible_data)} of {len(table_rows)}" if len(visible_data) else "No transactions to show")
+styling.finish(len(visible_data))
+
+# Plotly is only needed once there is data to draw
+import plotly.express as px
+import plotly.graph_objs as go
 
 # Function to configure the visuals for distribution plots
 update_display_main = lambda fig: st.plotly_chart(
@@ -706,40 +411,55 @@ update_display_main = lambda fig: st.plotly_chart(
         tickfont=dict(size=10)
     )
 )
-line_graph = px.line(filtered_data, x='transaction_date', y='amount')
-update_display_main(line_graph)
-
-# Generating ripples for visualization
-def generate_ripple_effect(filtered_data, n_points=300):
-
-    transaction_count = filtered_data['transaction_names'].nunique()
-
-    x_ripple = np.random.uniform(filtered_data['balance_category_num'].min(), filtered_data['balance_category_num'].max(), n_points)
-    y_ripple = np.random.uniform(filtered_data['amount_category_num'].min(), filtered_data['amount_category_num'].max(), n_points)
-    z_ripple = np.random.uniform(0, transaction_count, n_points)
-    size_ripple = np.random.uniform(75, 4, n_points)
-
-    # Generate distinguishable colors for the ripple effect
-    color_ripple = np.random.choice(px.colors.qualitative.Plotly, n_points)
-
-    return x_ripple, y_ripple, z_ripple, size_ripple, color_ripple
-
-# Generate ripple effect data
-x_ripple, y_ripple, z_ripple, size_ripple, color_ripple = generate_ripple_effect(filtered_data)
-
-# Create the base scatter plot
-scatter_plot = px.scatter_3d(
-    filtered_data,
-    x='balance',
-    y='amount',
-    z=filtered_data.index,
-    color='balance',
-    size='amount',
-    title='Distribution of transaction values against balance over time',
-    opacity=1,
-    labels={'amount': 'Amount spent', 'balance': 'Remaining balance', 'index': 'Transaction Count'}
+# The line chart draws at most charts.LINE_CHART_POINTS points, keeping the spikes
+with Stage('line_chart', len(filtered_data)) as line_chart:
+    line_points = cached_line_points(rows.state, filtered_data['transaction_date'].to_numpy(), filtered_data['amount'].to_numpy())
+    line_graph = px.line(filtered_data.iloc[line_points], x='transaction_date', y='amount')
+    line_chart.rows_out = len(line_points)
+    update_display_main(line_graph)
+
+scatter = Stage('scatter_3d', len(filtered_data))
+
+# Ripple effect data, the same for every rerun over the same extent
+x_ripple, y_ripple, z_ripple, size_ripple, color_ripple = ripple_surface(
+    (filtered_data['balance_category_num'].min(), filtered_data['balance_category_num'].max()),
+    (filtered_data['amount_category_num'].min(), filtered_data['amount_category_num'].max()),
+    filtered_data['transaction_names'].nunique(),
+    px.colors.qualitative.Plotly
 )
 
+# Create the base scatter plot; beyond charts.SCATTER_POINTS rows, one marker
+# is drawn per voxel of balance range, amount range and time span, sized by its
+# number of transactions
+if len(filtered_data) > SCATTER_POINTS:
+    voxels = cached_scatter_voxels(rows.state, filtered_data)
+    scatter_plot = px.scatter_3d(
+        voxels,
+        x='balance',
+        y='amount',
+        z='position',
+        color='balance',
+        size='count',
+        hover_data=['amount_sum'],
+        title='Distribution of transaction values against balance over time',
+        opacity=1,
+        labels={'amount': 'Mean amount spent', 'balance': 'Mean remaining balance', 'position': 'Transaction Count',
+                'count': 'Transactions', 'amount_sum': 'Amount spent'}
+    )
+    scatter.rows_out = len(voxels)
+else:
+    scatter_plot = px.scatter_3d(
+        filtered_data,
+        x='balance',
+        y='amount',
+        z=filtered_data.index,
+        color='balance',
+        size='amount',
+        title='Distribution of transaction values against balance over time',
+        opacity=1,
+        labels={'amount': 'Amount spent', 'balance': 'Remaining balance', 'index': 'Transaction Count'}
+    )
+
 # Add a 3D surface plot (Commented out in the original code)
 scatter_plot.add_trace(go.Surface(
      z=z_ripple.reshape((75, 4)),  # Reshape for surface plot
@@ -749,13 +469,17 @@ scatter_plot.add_trace(go.Surface(
      showscale=False
  ))
 update_display_main(scatter_plot)
+scatter.finish()
 
 # Distribution visualizations
 st.header("Distribution Visualizations")
-bucket_counts = filtered_data['transaction_category'].value_counts()
-name_counts = filtered_data['transaction_names'].value_counts()
+# Counts of the charted rows by month, category, name, payment method and
+# amount scale, from the dataset's rollup cube; the charts group these further
+chart_totals = cached_row_totals(rows.state, cube, rows.charts)
+bucket_counts = cube.rollup(chart_totals, ['transaction_category']).sort_values('count', ascending=False, kind='stable')
+name_counts = cube.rollup(chart_totals, ['transaction_names']).sort_values('count', ascending=False, kind='stable')
 
-df = bucket_counts.reset_index()
+df = bucket_counts[['transaction_category', 'count']]
 df.columns = ['Bucket', 'Count']
 
 # Function to configure the visuals for distribution plots
@@ -782,22 +506,24 @@ update_display_dist = lambda fig: st.plotly_chart(
 )
 
 # Distribution Visualization 1
-distribution_count = px.bar(df, x='Bucket', y='Count', title='Transaction Category Count', 
-             labels={'Bucket': 'Bucket', 'Count': 'Count'}, 
-             color='Count')
+with Stage('category_chart', len(filtered_data)):
+    distribution_count = px.bar(df, x='Bucket', y='Count', title='Transaction Category Count', 
+                 labels={'Bucket': 'Bucket', 'Count': 'Count'}, 
+                 color='Count')
 
-update_display_dist(distribution_count)
+    update_display_dist(distribution_count)
 
 # Distribution Visualization 3
 
-df = name_counts.reset_index()
+df = name_counts[['transaction_names', 'count']]
 df.columns = ['Name', 'Count']
 
-distribution_names = px.bar(df, x='Name', y='Count', title='Transaction Names Count', 
-             labels={'Name': 'Name', 'Count': 'Count'}, 
-             color='Count')
+with Stage('names_chart', len(filtered_data)):
+    distribution_names = px.bar(df, x='Name', y='Count', title='Transaction Names Count', 
+                 labels={'Name': 'Name', 'Count': 'Count'}, 
+                 color='Count')
 
-update_display_dist(distribution_names)
+    update_display_dist(distribution_names)
 
  # Create and display the parallel categories plot with labels
 labels = {
@@ -808,15 +534,19 @@ labels = {
             "amount_category_num": "Amount Scale"
         }
 
-# Parallel categories        
-fig = px.parallel_categories(
-            filtered_data,
-            dimensions=['transaction_month', 'transaction_year', 'payment_method_acronym', 'transaction_category'],
-            labels=labels,
-            color='amount_category_num',
-            title='Parallel categories plot between transaction date, transaction category and payment method'
-        )
-update_display_main(fig)
+# Parallel categories, one path per combination of values weighted by its count
+with Stage('parallel_categories', len(filtered_data)) as parallel:
+    paths = cube.rollup(chart_totals, ['transaction_month', 'transaction_year', 'payment_method_acronym',
+                                       'transaction_category', 'amount_category_num'])
+    fig = px.parallel_categories(
+                paths,
+                dimensions=['transaction_month', 'transaction_year', 'payment_method_acronym', 'transaction_category'],
+                labels=labels,
+                color='amount_category_num',
+                title='Parallel categories plot between transaction date, transaction category and payment method'
+            ).update_traces(counts=paths['count'])
+    parallel.rows_out = len(paths)
+    update_display_main(fig)
 
 # Function to convert DataFrame to CSV
 def convert_df_to_csv(df):
@@ -826,7 +556,9 @@ def convert_df_to_csv(df):
 st.write("Here is the preview of the original data")
 
 # Add a download button at the bottom of the page
-csv = convert_df_to_csv(filtered_data)
+with Stage('csv_export', len(filtered_data)) as export:
+    csv = convert_df_to_csv(filtered_data)
+    export.rows_out = len(filtered_data)
 
 st.download_button(
     label="Download data as CSV",
@@ -854,3 +586,9 @@ st.sidebar.markdown(
     """,
     unsafe_allow_html=True
 )
+
+status_message.caption('Computation complete')
+
+# Performance panel: wall time, rows and memory change of each stage in this rerun
+with st.sidebar.expander('Performance'):
+    st.dataframe(timings.summary(), hide_index=True)
@@ -0,0 +1,173 @@
+# Benchmarks of the enrichment pipeline and the app's filters on synthetic statements
+#
+# Each size gets a synthetic statement (see synthetic_statements.py), generated
+# once and kept under .cache/benchmarks. Every benchmark is timed as an
+# instrumentation Stage, and the results are written as JSON together with the
+# commit and library versions, so runs on different commits can be compared.
+#
+# The per-row categorizers are timed over the distinct values they see in the
+# app, the way enrich_descriptions calls them.
+#
+# usage: python benchmark.py [--sizes 10000 100000] [--repeat 3] [--output benchmark_results.json]
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+
+import numpy as np
+import pandas as pd
+
+from caching import LRUCache
+from charts import min_max_points, scatter_voxels
+from categorizer import CATEGORY_COLUMNS, categorize_buckets, categorize_name, enrich_descriptions, extract_entity, extract_name
+from indexes import TransactionIndex
+from instrumentation import Stage
+from pipeline import (add_date_parts, add_value_categories, filter_cache, filter_rows, filter_state_rows, filter_transactions,
+                      process_data, search_transactions)
+from rollups import RollupCube
+from search import SearchIndex
+from storage import CSV_DTYPES, DATE_COLUMNS, MONEY_COLUMNS, clean_columns, normalize_column_names, parse_dates
+from synthetic_statements import write_statement
+
+# Statement sizes benchmarked by default, in rows
+SIZES = [10_000, 100_000, 1_000_000, 10_000_000]
+
+# Directory holding the generated statements between runs
+BENCHMARK_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache', 'benchmarks')
+
+# Keywords searched for by the search benchmarks
+SEARCH_KEYWORD = 'zomato'
+FUZZY_KEYWORD = 'swigy'
+
+# Groupings of the rollup cube drawn by the app's distribution charts
+CHART_ROLLUPS = [['transaction_category'], ['transaction_names'],
+                 ['transaction_month', 'transaction_year', 'payment_method_acronym', 'transaction_category', 'amount_category_num']]
+
+# Share of a statement appended to it by the incremental benchmarks, as a daily refresh would
+APPENDED_SHARE = 0.01
+
+
+def current_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+# Synthetic statement of `rows` rows, generated on first use
+def statement_csv(rows, seed=0):
+    path = os.path.join(BENCHMARK_DIRECTORY, f'statement-{rows}-seed{seed}.csv')
+    if not os.path.exists(path):
+        os.makedirs(BENCHMARK_DIRECTORY, exist_ok=True)
+        write_statement(f'{path}.tmp', rows, seed)
+        os.replace(f'{path}.tmp', path)
+    return path
+
+# Time `function(*args)` as benchmark `name`, returning its result and its record
+def measure(name, rows_in, function, *args):
+    with Stage(name, rows_in) as current:
+        result = function(*args)
+        current.rows_out = len(result) if hasattr(result, '__len__') else None
+    return result, current.record
+
+def per_value(function, values):
+    return [function(value) for value in values]
+
+# Stage records of every benchmark on one statement, in pipeline order
+def run_benchmarks(path):
+    records = []
+
+    raw = pd.read_csv(path, dtype=CSV_DTYPES, thousands=',')
+    raw.columns = normalize_column_names(raw.columns)
+    for column in DATE_COLUMNS:
+        raw[column] = parse_dates(raw[column])
+    statement, record = measure('clean_columns', len(raw), clean_columns, raw, MONEY_COLUMNS)
+    records.append(record)
+    statement = statement.drop(columns=['sl_no', 'dr___cr1'])
+
+    descriptions = statement['description'].unique()
+    entities = pd.unique(np.asarray(per_value(extract_entity, descriptions), dtype=object))
+    names = pd.unique(np.asarray(per_value(extract_name, descriptions), dtype=object))
+    records.append(measure('extract_name', len(descriptions), per_value, extract_name, descriptions)[1])
+    records.append(measure('categorize_name', len(entities), per_value, categorize_name, entities)[1])
+    categorize_buckets.cache_clear()
+    records.append(measure('categorize_buckets', len(names), per_value, categorize_buckets, names)[1])
+
+    data, record = measure('process_data', len(statement), process_data, statement)
+    records.append(record)
+    classifications, record = measure('categorization', len(data), enrich_descriptions, data['description'], LRUCache(len(descriptions)))
+    records.append(record)
+    data[CATEGORY_COLUMNS] = classifications[CATEGORY_COLUMNS]
+    data, record = measure('binning', len(data), add_value_categories, data)
+    records.append(record)
+    data = add_date_parts(data)
+
+    # The sidebar filters at their default positions, over the middle of the statement's dates
+    start_date, end_date = data['transaction_date'].quantile([0.1, 0.9])
+    index, record = measure('build_indexes', len(data), TransactionIndex, data)
+    records.append(record)
+    filtered, record = measure('filter_chain', len(data), filter_transactions, data, start_date, end_date, 35000, 45000, index)
+    records.append(record)
+    rows = filter_rows(index, start_date, end_date, 35000, 45000)
+    search, record = measure('build_search_index', len(data), SearchIndex, data)
+    records.append(record)
+    records.append(measure('search_transactions', len(filtered), search_transactions, SEARCH_KEYWORD, data, search, rows)[1])
+    # The first fuzzy search builds the trigram indexes
+    records.append(measure('fuzzy_search_cold', len(filtered), search_transactions, FUZZY_KEYWORD, data, search, rows, True)[1])
+    records.append(measure('fuzzy_search', len(filtered), search_transactions, FUZZY_KEYWORD, data, search, rows, True)[1])
+    # The sidebar's filter state, computed once and then found in the filter cache
+    filter_state = (path, index, search, start_date, end_date, 35000, 45000, -1, SEARCH_KEYWORD, False, (0, 70000), (0, 70000))
+    filter_cache.clear()
+    records.append(measure('filter_state', len(data), filter_state_rows, *filter_state)[1])
+    records.append(measure('filter_state_cached', len(data), filter_state_rows, *filter_state)[1])
+    records.append(measure('line_chart_points', len(filtered), min_max_points, filtered['transaction_date'].to_numpy(), filtered['amount'].to_numpy())[1])
+    records.append(measure('scatter_voxels', len(filtered), scatter_voxels, filtered)[1])
+    cube, record = measure('build_rollup_cube', len(data), RollupCube, data)
+    records.append(record)
+    records.append(measure('chart_rollups', len(filtered), lambda rows: [cube.rollup(cube.row_totals(rows), dimensions) for dimensions in CHART_ROLLUPS], rows)[1])
+    # The indexes, search index and cube of all but the last rows, extended in place with them
+    start = len(data) - max(int(len(data) * APPENDED_SHARE), 1)
+    indexes = [TransactionIndex(data.iloc[:start]), SearchIndex(data.iloc[:start]), RollupCube(data.iloc[:start])]
+    records.append(measure('extend_indexes', len(data) - start, lambda: [index.extend(data, start) for index in indexes])[1])
+    records.append(measure('csv_export', len(filtered), lambda frame: frame.to_csv(index=False).encode('utf-8'), filtered)[1])
+    return records
+
+# Fastest run of each benchmark across `repeat` runs, tagged with the statement size
+def benchmark_size(rows, repeat=1, seed=0):
+    path = statement_csv(rows, seed)
+    best = {}
+    for _ in range(repeat):
+        for record in run_benchmarks(path):
+            if record['stage'] not in best or record['wall_ms'] < best[record['stage']]['wall_ms']:
+                best[record['stage']] = record
+    return [{'size': rows, 'benchmark': record.pop('stage'), **record} for record in best.values()]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the enrichment pipeline on synthetic statements.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES, help='statement sizes in rows')
+    parser.add_argument('--repeat', type=int, default=1, help='runs per size; the fastest run of each benchmark is kept')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the synthetic statements')
+    parser.add_argument('--output', default='benchmark_results.json', help='JSON file to write the results to')
+    args = parser.parse_args()
+
+    results = []
+    for rows in args.sizes:
+        for result in benchmark_size(rows, args.repeat, args.seed):
+            results.append(result)
+            print(f"{rows:>10} {result['benchmark']:<20} {result['wall_ms']:>12.1f} ms")
+
+    report = {
+        'commit': current_commit(),
+        'created': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'numpy': np.__version__,
+        'seed': args.seed,
+        'repeat': args.repeat,
+        'results': results,
+    }
+    with open(args.output, 'w') as file:
+        json.dump(report, file, indent=2)
@@ -0,0 +1,193 @@
+# Caches shared across Streamlit reruns and server restarts
+#
+# Imported modules outlive a rerun of app_v1.py, so an in-process cache held
+# here survives every slider move and keystroke for as long as the server
+# process runs. Enriched frames are also kept on disk as Parquet parts, so a
+# cold start can load them instead of recomputing them.
+import glob
+import hashlib
+import os
+import shutil
+import threading
+import uuid
+from collections import OrderedDict
+
+import pandas as pd
+
+# Directory holding frames that grow by appending rows, one directory of parts per key
+APPENDED_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache', 'appended')
+
+# Number of frames kept on disk; the least recently written are removed
+CACHED_FRAMES_KEPT = 8
+
+# Parts a growing frame is stored in at most; beyond it, they are rewritten as one
+APPENDED_PARTS_KEPT = 16
+
+
+# Least-recently-used mapping holding at most `max_entries` items and, when
+# `max_bytes` is given, values of at most that many bytes as told by their
+# `nbytes`, as for numpy arrays; values without one count as empty
+#
+# App sessions run on threads of their own and share these caches, so every
+# operation holds the cache's lock.
+class LRUCache:
+
+    def __init__(self, max_entries, max_bytes=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.nbytes = 0
+        self.lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def get(self, key, default=None):
+        with self.lock:
+            if key not in self.entries:
+                return default
+            self.entries.move_to_end(key)
+            return self.entries[key]
+
+    # Store a value; a value larger than max_bytes on its own is not kept
+    def put(self, key, value):
+        with self.lock:
+            self.pop(key)
+            if self.max_bytes is not None and getattr(value, 'nbytes', 0) > self.max_bytes:
+                return
+            self.entries[key] = value
+            self.nbytes += getattr(value, 'nbytes', 0)
+            while self.entries and (len(self.entries) > self.max_entries or
+                                    (self.max_bytes is not None and self.nbytes > self.max_bytes)):
+                self.pop(next(iter(self.entries)))
+
+    def pop(self, key, default=None):
+        with self.lock:
+            if key not in self.entries:
+                return default
+            value = self.entries.pop(key)
+            self.nbytes -= getattr(value, 'nbytes', 0)
+            return value
+
+    # Snapshot of (key, value) pairs, oldest first, without touching recency
+    def items(self):
+        with self.lock:
+            return list(self.entries.items())
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.nbytes = 0
+
+
+# SHA-256 of a file's content, by (path, modification time, size, bytes hashed)
+file_hashes = {}
+
+# Content hash of a file, or of its first `end` bytes, recomputed only when
+# the file changes on disk
+def file_hash(path, end=None):
+    stat = os.stat(path)
+    end = stat.st_size if end is None else end
+    key = (os.path.abspath(path), stat.st_mtime_ns, stat.st_size, end)
+    if key not in file_hashes:
+        digest = hashlib.sha256()
+        with open(path, 'rb') as file:
+            remaining = end
+            for block in iter(lambda: file.read(min(1 << 20, remaining)), b''):
+                digest.update(block)
+                remaining -= len(block)
+        file_hashes[key] = digest.hexdigest()
+    return file_hashes[key]
+
+# Cache key combining every input that an enriched frame depends on
+def cache_key(*parts):
+    return hashlib.sha256('\n'.join(str(part) for part in parts).encode()).hexdigest()
+
+# Temporary file name next to `path`, unique so concurrent writers of the same path never share one
+def temporary_file_path(path):
+    return f'{path}.{uuid.uuid4().hex}.tmp'
+
+# Write a frame to Parquet with `attrs`, which must be JSON, through a temporary
+# file so readers never see a partial frame
+def write_frame(path, frame, attrs=None):
+    frame = frame.copy(deep=False)
+    frame.attrs = dict(attrs or {})
+    frame.attrs['categoricals'] = {
+        column: {'categories': frame[column].cat.categories.tolist(), 'ordered': bool(frame[column].cat.ordered)}
+        for column in frame.columns if isinstance(frame[column].dtype, pd.CategoricalDtype)
+    }
+    temporary_path = temporary_file_path(path)
+    try:
+        frame.to_parquet(temporary_path)
+        os.replace(temporary_path, path)
+    except BaseException:
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+        raise
+
+# Remove all but the `kept` most recently modified of `paths`, files or directories
+def remove_oldest(paths, kept):
+    for old_path in sorted(paths, key=os.path.getmtime, reverse=True)[kept:]:
+        try:
+            if os.path.isdir(old_path):
+                shutil.rmtree(old_path)
+            else:
+                os.remove(old_path)
+        except OSError:
+            pass
+
+
+def appended_directory(key):
+    return os.path.join(APPENDED_DIRECTORY, key)
+
+# Frame stored under a key by store_appended_rows, with the attrs it was last
+# stored with, or None when it is missing or unreadable
+#
+# Each part holds the rows from its 'start' to its 'stop'. Parts are read in
+# order, skipping any left over from before the parts were rewritten as one.
+def load_appended_frame(key):
+    parts = []
+    rows = 0
+    try:
+        for path in sorted(glob.glob(os.path.join(appended_directory(key), '*.parquet'))):
+            part = pd.read_parquet(path)
+            if part.attrs.get('start') == rows:
+                parts.append(part)
+                rows = part.attrs['stop']
+    except (OSError, ValueError, ImportError):
+        return None
+    if not parts:
+        return None
+    # Categories only grow as rows are appended, so the last part's fit every part
+    attrs = parts[-1].attrs
+    for column, dtype in attrs.pop('categoricals', {}).items():
+        for part in parts:
+            part[column] = pd.Categorical(part[column], categories=dtype['categories'], ordered=dtype['ordered'])
+    frame = pd.concat(parts) if len(parts) > 1 else parts[0]
+    frame.attrs = {name: value for name, value in attrs.items() if name not in ('start', 'stop')}
+    return frame
+
+# Store the rows of a frame from position `start` on as the next part of the
+# frame stored under a key, with `attrs`; a start of 0 replaces the frame.
+# The disk cache is best effort, so failures are ignored.
+def store_appended_rows(key, frame, start, attrs=None):
+    directory = appended_directory(key)
+    try:
+        if start == 0 and os.path.isdir(directory):
+            shutil.rmtree(directory)
+        os.makedirs(directory, exist_ok=True)
+        parts = sorted(glob.glob(os.path.join(directory, '*.parquet')))
+        if len(parts) >= APPENDED_PARTS_KEPT:
+            start = 0
+        attrs = dict(attrs or {}, start=start, stop=len(frame))
+        write_frame(os.path.join(directory, f'{start:012d}.parquet'), frame.iloc[start:], attrs)
+        # Parts after a rewritten first part are skipped when loading, and removed here
+        if start == 0:
+            for path in parts[1:]:
+                os.remove(path)
+    except (OSError, ValueError, ImportError):
+        return
+    remove_oldest(glob.glob(os.path.join(APPENDED_DIRECTORY, '*')), CACHED_FRAMES_KEPT)
@@ -0,0 +1,607 @@
+# Transaction categorization rules and categorizers
+#
+# Every pattern in this module is compiled once, when the module is first
+# imported. Streamlit re-executes app_v1.py on every interaction, but imported
+# modules stay loaded, so reruns reuse the compiled rules instead of rebuilding
+# them for every row.
+#
+# The counterparty, bucket and payment method rules live in CSV files next to
+# this module and are reloaded by reload_rules() when they change on disk.
+#
+# Large batches of new descriptions can be classified on a process pool; see
+# classify_parallel.
+import csv
+import hashlib
+import io
+import os
+import re
+from collections import namedtuple
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+from caching import LRUCache
+from workers import can_fork, fork_pool
+
+try:
+    from re import _parser as sre_parse  # Python 3.11+
+except ImportError:
+    import sre_parse
+
+# Global inline flags such as "(?i)" at the start of a rule's pattern
+inline_flags_pattern = re.compile(r'^\(\?([aiLmsux]+)\)')
+
+# Character class escapes for the categories sre_parse reports
+category_escapes = {
+    sre_parse.CATEGORY_DIGIT: r'\d', sre_parse.CATEGORY_NOT_DIGIT: r'\D',
+    sre_parse.CATEGORY_SPACE: r'\s', sre_parse.CATEGORY_NOT_SPACE: r'\S',
+    sre_parse.CATEGORY_WORD: r'\w', sre_parse.CATEGORY_NOT_WORD: r'\W',
+}
+
+
+# Character class items that can start a match of a parsed pattern
+#
+# Returns (items, nullable), where nullable means the pattern may match without
+# consuming a character, or None when the first character can't be bounded.
+def first_characters(parsed, flags):
+    items = set()
+    for op, av in parsed:
+        if op is sre_parse.AT:
+            continue
+        if op is sre_parse.LITERAL:
+            items.add(re.escape(chr(av)))
+            return items, False
+        if op is sre_parse.IN:
+            for item_op, item_av in av:
+                if item_op is sre_parse.LITERAL:
+                    items.add(re.escape(chr(item_av)))
+                elif item_op is sre_parse.RANGE:
+                    items.add(f'{re.escape(chr(item_av[0]))}-{re.escape(chr(item_av[1]))}')
+                elif item_op is sre_parse.CATEGORY and item_av in category_escapes:
+                    items.add(category_escapes[item_av])
+                else:
+                    return None
+            return items, False
+        if op is sre_parse.SUBPATTERN:
+            # A scoped (?i:...) inside a case-sensitive table would need both cases
+            if av[1] & re.IGNORECASE and not flags & re.IGNORECASE:
+                return None
+            first = first_characters(av[3], flags)
+        elif op is sre_parse.BRANCH:
+            firsts = [first_characters(branch, flags) for branch in av[1]]
+            if None in firsts:
+                return None
+            first = (set().union(*(chars for chars, _ in firsts)), any(nullable for _, nullable in firsts))
+        elif op in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT):
+            first = first_characters(av[2], flags)
+            if first is not None and av[0] == 0:
+                first = (first[0], True)
+        else:
+            return None
+        if first is None:
+            return None
+        items |= first[0]
+        if not first[1]:
+            return items, False
+    return items, True
+
+
+# Whether a parsed pattern refers back to one of its groups, as \1 or (?P=name) do
+def has_backreference(parsed):
+    for op, av in parsed:
+        if op in (sre_parse.GROUPREF, sre_parse.GROUPREF_EXISTS):
+            return True
+        for part in av if isinstance(av, (tuple, list)) else [av]:
+            for subpattern in part if isinstance(part, list) else [part]:
+                if isinstance(subpattern, sre_parse.SubPattern) and has_backreference(subpattern):
+                    return True
+    return False
+
+
+# Maximum number of distinct descriptions whose categories are kept between reruns
+ENRICHMENT_CACHE_SIZE = 200_000
+
+# Tables with fewer rules than this are matched rule by rule, since sre's literal
+# search on a handful of short patterns beats one combined alternation
+COMBINE_MIN_RULES = 8
+
+# Worker processes classifying new descriptions in parallel; 0 classifies them
+# in the calling process. Parallel classification only pays off for batches of
+# tens of thousands of new descriptions, e.g. the first load of a large export.
+CLASSIFY_WORKERS = 0
+
+# Descriptions per task sent to a classification worker
+CLASSIFY_CHUNK_SIZE = 20_000
+
+
+# Ordered table of (category, compiled pattern) rules where the first match wins
+#
+# The rules are also combined into one alternation with a marker group per rule,
+# so a description is scanned by a single compiled pattern instead of one
+# re.search per rule. At any position the alternation reports the highest
+# priority rule that matches there, so the lowest rule index seen across the
+# match positions is exactly the rule the sequential loop would have returned.
+# A lookahead on the characters that can start any rule lets the scan skip
+# positions without trying every alternative.
+#
+# The full alternation is compiled when the table is built, so rules that
+# only fail together, such as two defining the same group name, raise
+# re.error there. Backreferences are rejected, as the groups they refer to
+# are numbered differently once combined.
+class RuleTable:
+
+    def __init__(self, patterns, flags=0, version=None):
+        self.patterns = dict(patterns)
+        self.flags = flags
+        # Content hash of the rules, so results can be tied to the rules that produced them
+        self.version = version or hashlib.sha256(repr((list(self.patterns.items()), flags)).encode()).hexdigest()
+        self.categories = list(self.patterns)
+        self.rules = [(category, re.compile(pattern, flags)) for category, pattern in self.patterns.items()]
+        self.combined = {}
+        self.alternatives = []
+        self.starts = []
+        for index, (category, pattern) in enumerate(self.patterns.items()):
+            # Global flags are only allowed at the very start of a pattern, so scope them to the rule
+            if inline_flags_pattern.match(pattern):
+                pattern = inline_flags_pattern.sub(r'(?\1:', pattern, count=1) + ')'
+            # An empty marker group after each rule records which alternative matched
+            self.alternatives.append(f'(?:{pattern})(?P<rule{index}>)')
+            parsed = sre_parse.parse(pattern, flags)
+            if has_backreference(parsed):
+                raise re.error(f'backreferences are not supported, in the rule for {category}')
+            first = first_characters(parsed, flags)
+            self.starts.append(first[0] if first is not None and not first[1] else None)
+        self._combined(len(self.rules))
+
+    # Table read from a category,pattern CSV file, versioned by the file's content hash
+    #
+    # Building the table compiles every rule and their combined alternation, so
+    # a file whose rules can't be matched raises ValueError here.
+    @classmethod
+    def load(cls, path, flags=0):
+        with open(path, 'rb') as file:
+            content = file.read()
+        try:
+            rows = csv.DictReader(io.StringIO(content.decode('utf-8'), newline=''))
+            patterns = {row['category']: row['pattern'] for row in rows}
+            return cls(patterns, flags, hashlib.sha256(content).hexdigest())
+        except (KeyError, UnicodeDecodeError, csv.Error, re.error, OverflowError) as error:
+            raise ValueError(f"Invalid rule file {path}: {error}") from error
+
+    # Table holding only the given categories, in this table's priority order
+    def subset(self, categories):
+        return RuleTable({category: pattern for category, pattern in self.patterns.items() if category in categories}, self.flags)
+
+    # Alternation of the first `count` rules, compiled on first use
+    def _combined(self, count):
+        regex = self.combined.get(count)
+        if regex is None:
+            starts = self.starts[:count]
+            prefilter = f'(?=[{"".join(sorted(set().union(*starts)))}])' if starts and None not in starts else ''
+            regex = re.compile(prefilter + '(?:' + '|'.join(self.alternatives[:count]) + ')', self.flags)
+            rule_index = {regex.groupindex[f'rule{index}']: index for index in range(count)}
+            self.combined[count] = regex = (regex, rule_index)
+        return regex
+
+    def match(self, text, default='Other'):
+        if len(self.rules) < COMBINE_MIN_RULES:
+            for category, regex in self.rules:
+                if regex.search(text):
+                    return category
+            return default
+        regex, rule_index = self._combined(len(self.rules))
+        found = regex.search(text)
+        return self._resolve(text, found) if found else default
+
+    # Category for a text given the first hit of the full combined pattern
+    def _resolve(self, text, found):
+        # The marker group closes last, so lastindex names the rule that matched
+        best = self._combined(len(self.rules))[1][found.lastindex]
+        while best > 0:
+            regex, rule_index = self._combined(best)
+            found = regex.search(text, found.start() + 1)
+            if not found:
+                break
+            best = rule_index[found.lastindex]
+        return self.categories[best]
+
+    # Column-level match over a Series of texts
+    def match_series(self, texts, default='Other'):
+        values = texts.to_numpy(dtype=object)
+        result = np.full(len(values), default, dtype=object)
+        if len(self.rules) < COMBINE_MIN_RULES:
+            # Each rule runs once over the rows no earlier rule matched
+            pending = np.arange(len(values))
+            for category, regex in self.rules:
+                if not len(pending):
+                    break
+                # A ufunc over the compiled search keeps the loop in C and the semantics of match()
+                hit = np.frompyfunc(regex.search, 1, 1)(values[pending]).astype(bool)
+                result[pending[hit]] = category
+                pending = pending[~hit]
+        elif len(values):
+            # One combined scan per row; only rows with a hit need their priority resolved
+            found = np.frompyfunc(self._combined(len(self.rules))[0].search, 1, 1)(values)
+            hit = found.astype(bool)
+            result[hit] = np.frompyfunc(self._resolve, 2, 1)(values[hit], found[hit])
+        return pd.Series(result, index=texts.index)
+
+
+# Patterns used to pull an entity name out of a raw description
+slash_pattern = re.compile(r'/([A-Za-z\s]+?)/')
+embedded_pattern = re.compile(r'([A-Za-z]+(?:\s[A-Za-z]+)+)')
+specific_pattern = re.compile(r'SentIMPS\d+(\w+)\b')
+youtube_pattern = re.compile(r'\b(?:sold by\s+)?youtube\b', re.IGNORECASE)
+debit_card_pattern = re.compile(
+    r'\b(?:DEBIT CARD ANNUAL FEE \w{4}\d{4} FOR \d{4}|'
+    r'Chrg: Debit Card Annual Fee \d{4} For \d{4}|'
+    r'Rem Chrgs:Debit Card Annual Fee \d{4} For \d{4}|'
+    r'UPI/\w+/[\d\/]+/Debit Money Usi|'
+    r'Ins Debit A\\c SPLN \d+ dt \d{2}/\d{2}/\d{2,4}|'
+    r'Ins Debit A\\c PDL \d+ dt \d{2}/\d{2}/\d{2,4})', re.IGNORECASE
+)
+name_pattern = re.compile(r'\b[A-Z][a-z]+(?: [A-Z][a-z]+)*\b')
+cognizant_pattern = re.compile(r'\bCOGNIZANT\b|\bCOGNIZ.*?\b', re.IGNORECASE)
+amazon_pattern = re.compile(
+    r'\b(?:UPI/amazon(?:@apl|\.refu)?/\d+/.*|'
+    r'PCD/1186/(?:WWW\s)?AMAZON\s(?:IN|Seller\sServices|Pay)|'
+    r'PG\sAMAZON\sPAY\sINDIA\sPRI|'
+    r'UPI/Amazon\s(?:India|Prime\sRe(?:fund)?|Seller\sServices|Pay|Package)|'
+    r'UPI/AMAZON\sSELLER\sS(?:\s|/|UPI|MB\sUPI)?|'
+    r'UPI/AMAZON(?:\sSELLER\sS)?(?:/|UPI|MB\sUPI)?|'
+    r'PCD/1186/Amazon\s(?:Seller\sServices|Pay)|'
+    r'UPI/Amazon\s(?:India|Prime\sRe(?:fund)?)|'
+    r'UPI/AMAZON\s(?:SELLER\sS|SELLER\sS\s(?:UPI|MB\sUPI))\b'
+    r')',
+    re.IGNORECASE
+)
+
+# The extract_name cascade as (pattern, entity for a match), tried in order
+extraction_stages = [
+    (amazon_pattern, lambda found: 'Amazon'),
+    (cognizant_pattern, lambda found: found.group(0).title()),
+    (youtube_pattern, lambda found: found.group(0).title()),
+    (debit_card_pattern, lambda found: found.group(0)),
+    (slash_pattern, lambda found: found.group(1).title()),
+    (specific_pattern, lambda found: found.group(1).title()),
+    (name_pattern, lambda found: found.group(0).title()),
+    (embedded_pattern, lambda found: found.group(1).title()),
+]
+
+# Rule files next to this module as (file name, regex flags), by table name
+RULES_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+RULE_FILES = {
+    'names': ('patterns.csv', re.IGNORECASE),
+    'buckets': ('bucket_patterns.csv', re.IGNORECASE),
+    'payment_methods': ('payment_method_patterns.csv', 0),
+    'payment_method_acronyms': ('payment_method_acronym_patterns.csv', 0),
+}
+
+# Classification field each file-based table decides, and the texts it is matched against
+RULE_FIELDS = {
+    'names': ('transaction_names', ['description', 'extracted_entity']),
+    'payment_methods': ('payment_method', ['description']),
+    'payment_method_acronyms': ('payment_method_acronym', ['description']),
+}
+
+# Fallback brand names, checked when neither extraction nor the name rules match
+BRAND_RULES = RuleTable({}, re.IGNORECASE)
+
+
+# Modification time and size of each rule file when its table was loaded
+def rule_file_stat(name):
+    stat = os.stat(os.path.join(RULES_DIRECTORY, RULE_FILES[name][0]))
+    return stat.st_mtime_ns, stat.st_size
+
+def load_rule_table(name):
+    file_name, flags = RULE_FILES[name]
+    return RuleTable.load(os.path.join(RULES_DIRECTORY, file_name), flags)
+
+rule_tables = {name: load_rule_table(name) for name in RULE_FILES}
+rule_file_stats = {name: rule_file_stat(name) for name in RULE_FILES}
+
+# Combined hash of every rule table, changing whenever any rule file does
+def rules_version():
+    versions = [rule_tables[name].version for name in RULE_FILES] + [BRAND_RULES.version]
+    return hashlib.sha256('\n'.join(versions).encode()).hexdigest()
+
+# Categories whose result may differ between two versions of a table
+def changed_categories(old, new):
+    changed = {category for category in old.patterns.keys() | new.patterns.keys()
+               if old.patterns.get(category) != new.patterns.get(category)}
+    # Reordering the untouched rules changes which one wins, so treat every rule as changed
+    kept_old = [category for category in old.categories if category in new.patterns and category not in changed]
+    kept_new = [category for category in new.categories if category in old.patterns and category not in changed]
+    if kept_old != kept_new or old.flags != new.flags:
+        return set(old.categories) | set(new.categories)
+    return changed
+
+# Rules of every file-based table, as lists that survive a round trip through JSON
+def rule_specs():
+    return {name: {'patterns': [[category, pattern] for category, pattern in table.patterns.items()], 'flags': int(table.flags)}
+            for name, table in rule_tables.items()}
+
+# Changed categories by table name, between the rules in `specs` (see
+# rule_specs) and the loaded ones; tables missing from `specs` were empty
+def rule_changes(specs):
+    changes = {}
+    for name, table in rule_tables.items():
+        spec = specs.get(name, {'patterns': [], 'flags': 0})
+        changed = changed_categories(RuleTable({category: pattern for category, pattern in spec['patterns']}, spec['flags']), table)
+        if changed:
+            changes[name] = changed
+    return changes
+
+# Reload the rule files that changed on disk since they were last loaded
+#
+# Returns the changed categories by table name. A file that fails to load
+# raises ValueError before any table is replaced, so a bad edit keeps the
+# previous rules in place. Only cached classifications that the changed rules
+# could affect are dropped; the rest keep being served from the cache.
+def reload_rules():
+    stats = {name: rule_file_stat(name) for name in RULE_FILES}
+    reloaded = {name: load_rule_table(name) for name in RULE_FILES if stats[name] != rule_file_stats[name]}
+    rule_file_stats.update(stats)
+    changes = {name: changed_categories(rule_tables[name], table)
+               for name, table in reloaded.items() if table.version != rule_tables[name].version}
+    if not changes:
+        return {}
+    rule_tables.update({name: reloaded[name] for name in changes})
+    categorize_buckets.cache_clear()
+    invalidate_classifications(changes)
+    return changes
+
+# Everything derived from one description by a single classification pass
+Classification = namedtuple('Classification', [
+    'extracted_entity',
+    'transaction_names',
+    'payment_method',
+    'payment_method_acronym',
+    'transaction_category',
+])
+
+# Columns the app derives from a classification
+CATEGORY_COLUMNS = ['transaction_names', 'payment_method', 'payment_method_acronym', 'transaction_category']
+
+
+# Raw entity named in a description, before it is matched against the name rules
+def extract_entity(description):
+    # Amazon first, then Cognizant, YouTube, debit card charges, names enclosed by
+    # slashes, IMPS names, capitalised names and finally any embedded words
+    for regex, entity in extraction_stages:
+        found = regex.search(description)
+        if found:
+            return entity(found)
+    return 'Other'
+
+def extract_name(description):
+    extracted_name = extract_entity(description)
+
+    # Categorize the extracted name
+    categorized_name = categorize_name(extracted_name)
+    return categorized_name if categorized_name != 'Other' else extracted_name
+
+# Define the categorize_names function
+def categorize_name(extracted_name):
+    return rule_tables['names'].match(extracted_name)
+
+# Define the categorize_brands function
+def categorize_brands(description):
+    name = extract_name(description)
+    if name == 'Other':
+        return BRAND_RULES.match(description)
+    else:
+        return name
+
+# Buckets are matched on the canonical name, so each distinct name is bucketed once
+@lru_cache(maxsize=ENRICHMENT_CACHE_SIZE)
+def categorize_buckets(name):
+    name = extract_name(name)
+    return rule_tables['buckets'].match(name)
+
+# Defining payment method categorization
+def categorize_payment_method(transaction_type):
+    return rule_tables['payment_methods'].match(transaction_type)
+
+# Defining payment method categorization acronyms for visuals
+def categorize_payment_method_acronyms(description):
+    return rule_tables['payment_method_acronyms'].match(description)
+
+
+# Define the combined function
+def combined_function_name(description):
+    return classify(description).transaction_names
+
+# Classify one description in a single pass through the extraction cascade
+def classify(description):
+    entity = extract_entity(description)
+    name = categorize_name(entity)
+    if name == 'Other':
+        name = entity
+    if name == 'Other':
+        # The description itself as a name, then as a brand
+        name = categorize_name(description)
+        if name == 'Other':
+            name = BRAND_RULES.match(description)
+    return Classification(
+        entity,
+        name,
+        categorize_payment_method(description),
+        categorize_payment_method_acronyms(description),
+        categorize_buckets(name),
+    )
+
+
+# Column-level equivalent of extract_entity
+def extract_entity_series(descriptions):
+    values = descriptions.to_numpy(dtype=object)
+    extracted = np.full(len(values), 'Other', dtype=object)
+    pending = np.arange(len(values))
+    for regex, entity in extraction_stages:
+        if not len(pending):
+            break
+        found = np.frompyfunc(regex.search, 1, 1)(values[pending])
+        hit = found.astype(bool)
+        if hit.any():
+            extracted[pending[hit]] = np.frompyfunc(entity, 1, 1)(found[hit])
+        pending = pending[~hit]
+    return pd.Series(extracted, index=descriptions.index)
+
+# Column-level equivalent of extract_name
+def extract_name_series(descriptions):
+    extracted = extract_entity_series(descriptions)
+    categorized = rule_tables['names'].match_series(extracted)
+    return categorized.where(categorized != 'Other', extracted)
+
+# Column-level equivalent of classify, returning one column per Classification field
+def classify_series(descriptions):
+    entities = extract_entity_series(descriptions)
+    names = rule_tables['names'].match_series(entities)
+    names = names.where(names != 'Other', entities)
+    other = (names == 'Other').to_numpy()
+    if other.any():
+        names[other] = rule_tables['names'].match_series(descriptions[other])
+        other = (names == 'Other').to_numpy()
+        if other.any():
+            names[other] = BRAND_RULES.match_series(descriptions[other])
+
+    # Bucket each distinct name once and broadcast back
+    name_codes, unique_names = pd.factorize(names)
+    buckets = rule_tables['buckets'].match_series(extract_name_series(pd.Series(unique_names, dtype=object)))
+
+    return pd.DataFrame({
+        'extracted_entity': entities,
+        'transaction_names': names,
+        'payment_method': rule_tables['payment_methods'].match_series(descriptions),
+        'payment_method_acronym': rule_tables['payment_method_acronyms'].match_series(descriptions),
+        'transaction_category': buckets.to_numpy(dtype=object)[name_codes],
+    }, index=descriptions.index)
+
+
+# Use the given rule tables, as (patterns, flags, version) by table name, in a classification worker
+def install_rule_tables(specs):
+    rule_tables.update({name: RuleTable(*spec) for name, spec in specs.items()})
+    categorize_buckets.cache_clear()
+
+# Classification pool by (workers, rules version); a pool is replaced when the rules change
+classify_pools = {}
+
+def classify_pool(workers):
+    key = (workers, rules_version())
+    if key not in classify_pools:
+        for pool in classify_pools.values():
+            pool.shutdown(wait=False, cancel_futures=True)
+        classify_pools.clear()
+        # The rules are shipped once per worker as pattern strings and compiled there
+        specs = {name: (table.patterns, table.flags, table.version) for name, table in rule_tables.items()}
+        classify_pools[key] = fork_pool(workers, install_rule_tables, (specs,))
+    return classify_pools[key]
+
+def classify_values(descriptions):
+    return classify_series(pd.Series(descriptions, dtype=object))
+
+# classify_series on a process pool, in chunks of `chunk_size` descriptions
+#
+# Every result depends on its own description only, so the chunks are
+# classified independently and reassembled in their original order, giving
+# exactly the serial result. Without fork support this falls back to
+# classify_series.
+def classify_parallel(descriptions, workers, chunk_size=CLASSIFY_CHUNK_SIZE):
+    if workers < 2 or len(descriptions) <= chunk_size or not can_fork():
+        return classify_series(descriptions)
+    values = descriptions.to_numpy(dtype=object)
+    chunks = [values[start:start + chunk_size] for start in range(0, len(values), chunk_size)]
+    classified = pd.concat(classify_pool(workers).map(classify_values, chunks), ignore_index=True)
+    classified.index = descriptions.index
+    return classified
+
+
+# Classification per distinct description, kept between reruns
+enrichment_cache = LRUCache(ENRICHMENT_CACHE_SIZE)
+
+# Classify a description column by its distinct values only
+#
+# Recurring UPI handles, salary credits and charges repeat across many rows, so
+# the column is factorized, only uniques missing from the cache are classified,
+# and the results are broadcast back to the rows by their codes. With `workers`
+# above 1, the missing uniques are classified by classify_parallel.
+def enrich_descriptions(descriptions, cache=enrichment_cache, workers=None, chunk_size=CLASSIFY_CHUNK_SIZE):
+    workers = CLASSIFY_WORKERS if workers is None else workers
+    codes, uniques = pd.factorize(descriptions, use_na_sentinel=False)
+    results = [cache.get(description) for description in uniques]
+    missing = [index for index, result in enumerate(results) if result is None]
+    if missing:
+        computed = classify_parallel(pd.Series(uniques[missing], dtype=object), workers, chunk_size)
+        for index, result in zip(missing, computed.itertuples(index=False, name='Classification')):
+            results[index] = result
+            cache.put(uniques[index], result)
+    table = pd.DataFrame.from_records(results, columns=Classification._fields)
+    enriched = table.take(codes)
+    enriched.index = descriptions.index
+    return enriched
+
+# Which of `classified`, classifications with their 'description', the
+# changed categories by table name could affect
+#
+# A first-match-wins result can only change if the rule that produced it
+# changed, or if a changed rule now matches the text.
+def stale_classifications(classified, changes):
+    stale = np.zeros(len(classified), dtype=bool)
+    for name, (field, texts) in RULE_FIELDS.items():
+        if name not in changes:
+            continue
+        stale |= classified[field].isin(changes[name]).to_numpy()
+        probe = rule_tables[name].subset(changes[name])
+        for text in texts:
+            stale |= probe.match_series(classified[text].astype(object), None).notna().to_numpy()
+    return stale
+
+# Drop cached classifications that changed rule tables could affect
+#
+# Buckets depend on the canonical name, so they are refreshed per distinct
+# name instead of dropping the classification.
+def invalidate_classifications(changes, cache=enrichment_cache):
+    items = cache.items()
+    if not items:
+        return
+    cached = pd.DataFrame.from_records([result for _, result in items], columns=Classification._fields)
+    cached['description'] = pd.Series([description for description, _ in items], dtype=object)
+    stale = stale_classifications(cached, changes)
+    for description in cached['description'][stale]:
+        cache.pop(description)
+
+    if 'names' in changes or 'buckets' in changes:
+        for (description, result), fresh in zip(items, ~stale):
+            bucket = categorize_buckets(result.transaction_names)
+            if fresh and bucket != result.transaction_category:
+                cache.put(description, result._replace(transaction_category=bucket))
+
+# Classifications of `data`, a frame of enriched descriptions holding every
+# Classification field, under the loaded rules, given the categories changed
+# since it was classified (see rule_changes); returns the positions of the
+# rows whose classification differs, and their new classifications
+#
+# As in invalidate_classifications, only the distinct descriptions the
+# changes could affect are classified again, and the buckets of the others
+# are refreshed per distinct name.
+def reclassify(data, changes, cache=enrichment_cache):
+    fields = list(Classification._fields)
+    codes, descriptions = pd.factorize(data['description'], use_na_sentinel=False)
+    first = np.zeros(len(descriptions), dtype=np.int64)
+    first[codes[::-1]] = np.arange(len(codes))[::-1]
+    classified = data[fields].iloc[first].reset_index(drop=True).astype(object)
+    classified['description'] = pd.Series(descriptions, dtype=object)
+    stale = stale_classifications(classified, changes)
+
+    refreshed = classified[fields].copy()
+    if stale.any():
+        refreshed.loc[stale, fields] = enrich_descriptions(classified['description'][stale], cache)[fields].to_numpy()
+    if ('names' in changes or 'buckets' in changes) and not stale.all():
+        names = refreshed['transaction_names'][~stale]
+        refreshed.loc[~stale, 'transaction_category'] = [categorize_buckets(name) for name in names]
+
+    previous = classified[fields]
+    changed = ~(refreshed.eq(previous) | (refreshed.isna() & previous.isna())).all(axis=1).to_numpy()
+    rows = np.flatnonzero(changed[codes])
+    return rows, refreshed.take(codes[rows]).reset_index(drop=True)
@@ -0,0 +1,145 @@
+# Chart data reduced to what the browser can draw
+#
+# The app's charts would otherwise send every transaction in the selected
+# period to the browser as Plotly JSON. The reductions here keep the shape of
+# a chart with a bounded number of points, and are cached per filter state
+# (see pipeline.FilteredRows.state), so moving back to a slider position
+# redraws without recomputing.
+import numpy as np
+import pandas as pd
+
+from caching import LRUCache
+
+# Points drawn by the amount-over-time line chart at most
+LINE_CHART_POINTS = 2000
+
+# Filter states whose chart data is kept between reruns
+CHART_STATES_KEPT = 64
+
+
+# Positions of the points of a line of `y` over `x` to draw, in order
+#
+# `x` must be sorted, as dates are in an enriched statement. The range of `x`
+# is cut into equal spans, like the pixels of the chart, and each keeps its
+# lowest and highest point, so no spike is lost; the first and last points are
+# kept too. A narrower range of `x` gets narrower spans, so zooming in with the
+# date slider shows more detail. Lines of at most `max_points` points are kept whole.
+def min_max_points(x, y, max_points=LINE_CHART_POINTS):
+    positions = np.flatnonzero(~(pd.isna(x) | pd.isna(y)))
+    if len(positions) <= max_points:
+        return positions
+    x = np.asarray(x[positions]).astype(np.int64)
+    y = np.asarray(y[positions], dtype=np.float64)
+
+    # Span of each point; spans are nondecreasing as x is sorted
+    spans = max((max_points - 2) // 2, 1)
+    width = max(x[-1] - x[0], 1)
+    span = np.minimum(((x - x[0]) / width * spans).astype(np.int64), spans - 1)
+    starts = np.flatnonzero(np.diff(span, prepend=-1))
+    segment = np.repeat(np.arange(len(starts)), np.diff(np.append(starts, len(span))))
+
+    # First lowest and first highest point of each span
+    kept = [[0, len(y) - 1]]
+    for extreme in (np.minimum.reduceat(y, starts), np.maximum.reduceat(y, starts)):
+        hits = np.flatnonzero(y == extreme[segment])
+        kept.append(hits[np.diff(segment[hits], prepend=-1) != 0])
+    return positions[np.unique(np.concatenate(kept))]
+
+
+# Line chart points by filter state and resolution
+line_chart_points = LRUCache(CHART_STATES_KEPT)
+
+# Positions of the points of the line of `y` over `x` drawn for a filter state, see min_max_points
+def cached_line_points(state, x, y, max_points=LINE_CHART_POINTS):
+    key = (state, max_points)
+    points = line_chart_points.get(key)
+    if points is None:
+        points = min_max_points(x, y, max_points)
+        line_chart_points.put(key, points)
+    return points
+
+
+# Rows drawn one marker each by the 3D balance/amount scatter at most;
+# larger selections are drawn as voxels, see scatter_voxels
+SCATTER_POINTS = 10000
+
+# Time spans of the selected period that voxels are cut into
+SCATTER_TIME_BUCKETS = 100
+
+# Seed of the voxel sampling and of the decorative ripple surface, so both
+# are the same on every rerun
+SCATTER_SEED = 0
+
+
+# Voxels of a 3D scatter of `data`, one row per balance range, amount range and time span holding rows
+#
+# Rows are grouped by balance_category_num, amount_category_num and an equal
+# span of transaction_date; each voxel has its row count, balance and amount
+# sums and means, and the mean index label of its rows, which stands in for
+# the index the scatter puts on its z axis. Beyond `max_points` voxels, a
+# sample weighted by row count is kept, so dense regions stay dense.
+def scatter_voxels(data, time_buckets=SCATTER_TIME_BUCKETS, max_points=SCATTER_POINTS, seed=SCATTER_SEED):
+    dates = data['transaction_date'].to_numpy().astype(np.int64)
+    bucket = np.zeros(len(dates), dtype=np.int64)
+    if len(dates):
+        width = max(dates.max() - dates.min(), 1)
+        bucket = np.minimum(((dates - dates.min()) / width * time_buckets).astype(np.int64), time_buckets - 1)
+
+    voxels = pd.DataFrame({
+        'balance_category_num': np.asarray(data['balance_category_num'], dtype=np.float64),
+        'amount_category_num': np.asarray(data['amount_category_num'], dtype=np.float64),
+        'time_bucket': bucket,
+        'balance': data['balance'].to_numpy(dtype=np.float64),
+        'amount': data['amount'].to_numpy(dtype=np.float64),
+        'position': np.asarray(data.index, dtype=np.float64),
+    }).groupby(['balance_category_num', 'amount_category_num', 'time_bucket'], dropna=False, sort=True).agg(
+        count=('position', 'size'),
+        balance_sum=('balance', 'sum'),
+        amount_sum=('amount', 'sum'),
+        position=('position', 'mean'),
+    ).reset_index()
+    voxels['balance'] = voxels['balance_sum'] / voxels['count']
+    voxels['amount'] = voxels['amount_sum'] / voxels['count']
+
+    if len(voxels) > max_points:
+        weights = voxels['count'].to_numpy() / voxels['count'].sum()
+        kept = np.random.default_rng(seed).choice(len(voxels), max_points, replace=False, p=weights)
+        voxels = voxels.iloc[np.sort(kept)].reset_index(drop=True)
+    return voxels
+
+
+# Scatter voxels by filter state and resolution
+scatter_voxel_frames = LRUCache(CHART_STATES_KEPT)
+
+# Voxels of the 3D scatter of `data` drawn for a filter state, see scatter_voxels
+def cached_scatter_voxels(state, data, time_buckets=SCATTER_TIME_BUCKETS, max_points=SCATTER_POINTS):
+    key = (state, time_buckets, max_points)
+    voxels = scatter_voxel_frames.get(key)
+    if voxels is None:
+        voxels = scatter_voxels(data, time_buckets, max_points)
+        scatter_voxel_frames.put(key, voxels)
+    return voxels
+
+
+# Decorative ripple surfaces by extent
+ripple_surfaces = LRUCache(CHART_STATES_KEPT)
+
+# Points of the decorative ripple surface drawn over the 3D scatter, as (x, y, z, size, color)
+#
+# The points are random within the balance and amount category ranges and
+# [0, depth), but seeded, so a selection with the same extent always gets the
+# same surface and it is computed once.
+def ripple_surface(balance_range, amount_range, depth, colors, n_points=300, seed=SCATTER_SEED):
+    key = (tuple(balance_range), tuple(amount_range), depth, tuple(colors), n_points, seed)
+    surface = ripple_surfaces.get(key)
+    if surface is None:
+        rng = np.random.default_rng(seed)
+        surface = (
+            rng.uniform(*balance_range, n_points),
+            rng.uniform(*amount_range, n_points),
+            rng.uniform(0, depth, n_points),
+            rng.uniform(4, 75, n_points),
+            rng.choice(colors, n_points),
+        )
+        ripple_surfaces.put(key, surface)
+    return surface
@@ -0,0 +1,170 @@
+# Sorted indexes over an enriched statement for the sidebar filters
+#
+# An enriched statement is sorted by transaction date, so a date range is a
+# contiguous run of rows found by binary search. Amounts, balances and the
+# credit/debit direction get sorted secondary indexes of their own; the last
+# partitions the rows into debits and credits. A filter starts from whichever index
+# matches the fewest rows and checks the other ranges on those rows only, so
+# moving a slider costs O(log n) plus the size of the result, not O(n).
+#
+# Rows are identified by their position in the enriched frame. Indexes are
+# built once per dataset version and kept between reruns.
+import copy
+
+import numpy as np
+import pandas as pd
+
+from caching import LRUCache
+
+# Number of datasets whose indexes are kept in memory
+INDEXES_KEPT = 4
+
+
+# Values of one column in sorted order, with the rows they came from
+class SortedIndex:
+
+    def __init__(self, values):
+        self.column = np.asarray(values)
+        # Missing values (NaN, NaT) sort last, where no closed range reaches them
+        if pd.Series(self.column).is_monotonic_increasing:
+            self.order = None
+            self.values = self.column
+        else:
+            self.order = np.argsort(self.column, kind='stable')
+            self.values = self.column[self.order]
+        self.present = len(self.values) - int(pd.isna(self.values).sum())
+
+    def __len__(self):
+        return len(self.values)
+
+    # Smallest and largest value, skipping missing ones; None when every value is missing
+    def extent(self):
+        if not self.present:
+            return None, None
+        return self.values[0], self.values[self.present - 1]
+
+    # Span [start, stop) of sorted positions holding values in [low, high]; None leaves a side open
+    def bounds(self, low=None, high=None):
+        start = 0 if low is None else int(np.searchsorted(self.values, np.asarray(low, dtype=self.values.dtype), 'left'))
+        stop = len(self.values) if high is None else int(np.searchsorted(self.values, np.asarray(high, dtype=self.values.dtype), 'right'))
+        return start, max(start, stop)
+
+    # Rows holding the values between sorted positions start and stop, as a slice when they are contiguous
+    def rows(self, start, stop):
+        return slice(start, stop) if self.order is None else self.order[start:stop]
+
+    # Index `values` appended to the column, merging them into the sorted order
+    #
+    # Values at or after the last one keep a monotonic column as it is;
+    # otherwise only the new values are sorted and then inserted, so existing
+    # rows are never sorted again. The arrays are replaced, never written to.
+    def extend(self, values):
+        values = np.asarray(values)
+        start = len(self.column)
+        self.column = np.concatenate([self.column, values])
+        if self.order is None and pd.Series(self.column[max(start - 1, 0):]).is_monotonic_increasing:
+            self.values = self.column
+        else:
+            order = np.arange(start) if self.order is None else self.order
+            new_order = np.argsort(values, kind='stable')
+            new_present = len(values) - int(pd.isna(values).sum())
+            # New values go after equal ones indexed before them, missing ones last
+            at = np.searchsorted(self.values[:self.present], values[new_order[:new_present]], 'right')
+            self.order = np.concatenate([np.insert(order, at, new_order[:new_present] + start), new_order[new_present:] + start])
+            self.values = self.column[self.order]
+        self.present = len(self.values) - int(pd.isna(self.values).sum())
+
+    # Which of `rows` hold values in [low, high]
+    def contains(self, rows, low=None, high=None):
+        values = self.column[rows]
+        keep = np.ones(len(values), dtype=bool)
+        if low is not None:
+            keep &= values >= np.asarray(low, dtype=values.dtype)
+        if high is not None:
+            keep &= values <= np.asarray(high, dtype=values.dtype)
+        return keep
+
+
+# Date, amount, balance and credit/debit indexes of one enriched statement
+class TransactionIndex:
+
+    def __init__(self, data):
+        self.rows_total = len(data)
+        self.indexes = {
+            'transaction_date': SortedIndex(data['transaction_date'].to_numpy()),
+            'amount': SortedIndex(data['amount'].to_numpy()),
+            'balance': SortedIndex(data['balance'].to_numpy()),
+            'credit_debit_value': SortedIndex(data['credit_debit_value'].to_numpy()),
+        }
+        # Sort keys of the columns the table has been sorted on, see sort_key
+        self.sort_keys = {}
+
+    # Copy sharing the arrays, so extending or updating it leaves this index as
+    # it is for those still filtering the rows it was built on
+    def copy(self):
+        index = copy.copy(self)
+        index.indexes = {column: copy.copy(sorted_index) for column, sorted_index in self.indexes.items()}
+        index.sort_keys = {}
+        return index
+
+    # Index the rows of `data` from position `start` on, appended since the index was built
+    def extend(self, data, start):
+        for column, index in self.indexes.items():
+            index.extend(data[column].to_numpy()[start:])
+        self.rows_total = len(data)
+        self.sort_keys = {}
+
+    # Account for the rows of `data` at `rows`, whose names or categories changed
+    # since the index was built; only the sort keys depend on them
+    def update(self, data, rows):
+        self.sort_keys = {}
+
+    # Rows whose columns fall in the given inclusive (low, high) ranges, in frame order
+    #
+    # Returns a slice when the rows are one contiguous run, as for a date range
+    # on its own, so the caller can take them without copying.
+    def rows(self, **ranges):
+        ranges = {column: bounds for column, bounds in ranges.items() if bounds != (None, None)}
+        if not ranges:
+            return slice(0, self.rows_total)
+        spans = {column: self.indexes[column].bounds(*bounds) for column, bounds in ranges.items()}
+        first = min(spans, key=lambda column: spans[column][1] - spans[column][0])
+        rows = self.indexes[first].rows(*spans[first])
+        if isinstance(rows, slice):
+            if len(ranges) == 1:
+                return rows
+            rows = np.arange(rows.start, rows.stop)
+        else:
+            rows = np.sort(rows)
+        rest = [column for column in ranges if column != first]
+        keep = np.ones(len(rows), dtype=bool)
+        for column in rest:
+            keep &= self.indexes[column].contains(rows, *ranges[column])
+        return rows[keep]
+
+    # Integer key of every row of `data` that orders it like `column`, missing values last
+    #
+    # Equal values share a key, so ties keep the frame order. Keys are computed
+    # on first use for each column and kept with the index.
+    def sort_key(self, data, column):
+        if column not in self.sort_keys:
+            keys, values = pd.factorize(data[column], sort=True)
+            keys[keys < 0] = len(values)
+            self.sort_keys[column] = keys.astype(np.int32) if len(values) < 2**31 else keys
+        return self.sort_keys[column]
+
+
+# Number of rows in a slice or an array of positions, as returned by TransactionIndex.rows
+def row_count(rows):
+    return rows.stop - rows.start if isinstance(rows, slice) else len(rows)
+
+# Indexes by dataset key, as returned by pipeline.append_statements
+transaction_indexes = LRUCache(INDEXES_KEPT)
+
+# Indexes of an enriched statement, built on first use for each dataset key
+def transaction_index(key, data):
+    index = transaction_indexes.get(key)
+    if index is None or index.rows_total != len(data):
+        index = TransactionIndex(data)
+        transaction_indexes.put(key, index)
+    return index
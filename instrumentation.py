@@ -0,0 +1,125 @@
+# Per-stage instrumentation of the pipeline and the app's views
+#
+# Every stage records its wall time, the rows it received and produced, and
+# the change in the process's resident memory. Records are written to the
+# 'bank_statement_analysis.stages' logger as one JSON object per line, and are
+# collected by the StageLog active in the current thread, which the app shows
+# in its performance panel. Streamlit runs each session's script in its own
+# thread, so concurrent sessions never see each other's stages.
+import functools
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+import pandas as pd
+
+stage_logger = logging.getLogger('bank_statement_analysis.stages')
+
+# StageLog collecting the stages run by this thread, if any
+active_logs = threading.local()
+
+
+# Resident memory of this process in bytes, or None where /proc is unavailable
+def resident_memory():
+    try:
+        with open('/proc/self/statm') as file:
+            return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+# Write stage records to `stream` (stderr by default) as JSON lines
+def enable_stage_logging(stream=None):
+    if not stage_logger.handlers:
+        handler = logging.StreamHandler(stream or sys.stderr)
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        stage_logger.addHandler(handler)
+        stage_logger.setLevel(logging.INFO)
+        stage_logger.propagate = False
+
+
+# Stage records of one run, e.g. one rerun of the app
+class StageLog:
+
+    def __init__(self, on_stage=None):
+        self.records = []
+        # Called with each record as its stage finishes
+        self.on_stage = on_stage
+
+    def add(self, record):
+        self.records.append(record)
+        if self.on_stage is not None:
+            self.on_stage(record)
+
+    # Collect the stages run by this thread from now on
+    def activate(self):
+        active_logs.log = self
+        return self
+
+    # One row per stage in the order stages first ran, adding up repeated runs such as chunks
+    def summary(self):
+        records = pd.DataFrame(self.records, columns=['stage', 'wall_ms', 'rows_in', 'rows_out', 'memory_delta_bytes'])
+        stages = records.groupby('stage', sort=False)
+        # Row counts and memory stay empty for stages that don't report them
+        summary = pd.DataFrame({
+            'calls': stages.size(),
+            'wall_ms': stages['wall_ms'].sum().round(3),
+            'rows_in': stages['rows_in'].sum(min_count=1).astype('Int64'),
+            'rows_out': stages['rows_out'].sum(min_count=1).astype('Int64'),
+            'memory_delta_mb': (stages['memory_delta_bytes'].sum(min_count=1) / 2**20).round(3),
+        })
+        return summary.reset_index()
+
+
+# Timing of one run of a stage, started when created
+#
+# Use it as a context manager, setting `rows_out` inside the block, or call
+# finish() where a stage spans code that can't be indented into one block.
+class Stage:
+
+    def __init__(self, name, rows_in=None):
+        self.name = name
+        self.rows_in = rows_in
+        self.rows_out = None
+        self.record = None
+        self.memory = resident_memory()
+        self.start = time.perf_counter()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.record is None:
+            self.finish()
+
+    # Record the stage in the JSON log and the active StageLog
+    def finish(self, rows_out=None):
+        wall_ms = (time.perf_counter() - self.start) * 1000
+        memory = resident_memory()
+        self.record = {
+            'stage': self.name,
+            'wall_ms': round(wall_ms, 3),
+            'rows_in': self.rows_in,
+            'rows_out': self.rows_out if rows_out is None else rows_out,
+            'memory_delta_bytes': None if memory is None or self.memory is None else memory - self.memory,
+        }
+        stage_logger.info(json.dumps(self.record))
+        log = getattr(active_logs, 'log', None)
+        if log is not None:
+            log.add(self.record)
+        return self.record
+
+# Decorator timing every call as stage `name`, counting rows of the first argument and the result
+def timed(name):
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            rows_in = len(args[0]) if args and hasattr(args[0], '__len__') else None
+            with Stage(name, rows_in) as current:
+                result = function(*args, **kwargs)
+                current.rows_out = len(result) if hasattr(result, '__len__') else None
+            return result
+        return wrapper
+    return decorator
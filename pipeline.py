@@ -0,0 +1,485 @@
+# Enrichment of typed statements and the filters the app applies to them
+#
+# These steps run without Streamlit, so the app, batch jobs and the benchmarks
+# share one implementation. Problems with the input raise ValueError; the app
+# turns them into a warning.
+#
+# Run as a script, it enriches statement files into CSV or Parquet, streaming
+# them chunk by chunk, or writes per-group totals of them:
+#
+# usage: python pipeline.py STATEMENT [STATEMENT ...] --output enriched.parquet
+#        python pipeline.py STATEMENT [STATEMENT ...] --output monthly.csv --group-by transaction_month
+import argparse
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+import categorizer
+from caching import LRUCache, cache_key, file_hash, load_appended_frame, store_appended_rows
+from categorizer import Classification, enrich_descriptions, reclassify, rule_changes, rule_specs
+from indexes import TransactionIndex, transaction_indexes
+from instrumentation import Stage, enable_stage_logging, timed
+from rollups import rollup_cubes
+from search import SearchIndex, search_indexes
+from storage import (STATEMENT_CHUNK_ROWS, aggregate_chunks, apply_stages, complete_end, concat_chunks, ingest_statement, ingest_statements, iter_statements,
+                     load_statement, read_statement_tail, statement_files, write_csv_chunks,
+                     write_statement_chunks)
+
+# Typed statement columns the pipeline reads; 'sl_no' and 'dr___cr1' are never used
+STATEMENT_COLUMNS = ['transaction_date', 'value_date', 'description', 'chq___ref_no', 'amount_paise', 'dr___cr', 'balance_paise']
+
+# Bump when enrich_data changes, so enriched frames cached by older code are rebuilt
+PIPELINE_VERSION = 5
+
+# credit_debit_value of each transaction direction
+DIRECTIONS = {'Credit': 1, 'Debit': -1}
+
+# Enriched frames kept in memory, by lineage key
+ENRICHED_FRAMES_KEPT = 4
+
+# Filter states whose rows are kept between reruns, and the memory their positions may take
+FILTER_STATES_KEPT = 256
+FILTER_CACHE_BYTES = 256 * 2**20
+
+
+# Deriving transaction details from a typed statement (see storage.normalize_statement)
+@timed('process_data')
+def process_data(df):
+    # Rupee values for display and filtering, next to the exact paise they come from
+    for column in ['amount', 'balance']:
+        df.insert(df.columns.get_loc(f'{column}_paise'), column, df[f'{column}_paise'] / 100)
+
+    # Splitting and mapping transaction details as boolean values
+    try:
+        df[['transaction_type', 'transaction_number']] = df['chq___ref_no'].str.split('-', expand=True)
+    except KeyError as error:
+        raise ValueError("Column 'chq___ref_no' not found in the dataframe.") from error
+
+    # Mapping 'dr___cr' to numerical values
+    mapping = {'CR': 1, 'DR': -1}
+    df['credit_debit_value'] = df['dr___cr'].astype(object).map(mapping).fillna(0)
+
+    # Adjusting net balance, multiplied in exact paise
+    try:
+        df['net_balance'] = df['balance_paise'] * df['credit_debit_value'] / 100
+    except KeyError as error:
+        raise ValueError("Column 'balance' not found in the dataframe.") from error
+
+    return df
+
+# Bucketing amounts and balances into doubling ranges: 0-500, 500-1000, 1000-2000, ...
+@timed('binning')
+def add_value_categories(data):
+    multiplier = 2
+    bin_edges = [0]
+    for i in range(1, 21):
+        next_edge = bin_edges[-1] * multiplier if bin_edges[-1] > 0 else 500
+        bin_edges.append(next_edge)
+
+    bin_labels = [f"{int(bin_edges[i])}-{int(bin_edges[i+1])}" for i in range(len(bin_edges)-1)]
+
+    # Create a mapping dictionary from labels to numerical values
+    label_mapping = {label: i for i, label in enumerate(bin_labels)}
+
+    # Create the balance_category and amount_category columns with their numerical values
+    for column in ['balance', 'amount']:
+        data[f'{column}_category'] = pd.cut(data[column], bins=bin_edges, labels=bin_labels, right=False)
+        data[f'{column}_category_num'] = data[f'{column}_category'].map(label_mapping)
+    return data
+
+# Month and year of each transaction, as shown by the charts
+def add_date_parts(data):
+    # Extract year and month and create a categorical column in the desired format
+    data['transaction_month'] = data['transaction_date'].dt.strftime('%b %Y')  # Format: 'Apr 2023'
+    data['transaction_year'] = data['transaction_date'].dt.strftime('%Y')  # Format: '2023'
+    return data
+
+# Full enrichment of a typed statement: categorization and binning
+def enrich_data(data):
+    data = process_data(data)
+
+    # Classify the distinct descriptions once into names, payment methods and
+    # buckets; the extracted entity is kept for classifying them again (see reclassify_statements)
+    with Stage('categorization', len(data)) as categorization:
+        classifications = enrich_descriptions(data['description'])
+        data[list(Classification._fields)] = classifications
+        categorization.rows_out = len(classifications)
+
+    data = add_value_categories(data)
+    data = add_date_parts(data)
+
+    # Optionally, you can sort and see the data; a stable sort keeps same-day
+    # transactions in statement order, however the statement was chunked
+    data.sort_values(by='transaction_date', kind='stable', inplace=True)
+    return data
+
+# Enriched chunks of the given CSV statements, or of the first `ends` bytes of each, earliest statement first
+def iter_enriched(file_paths, chunk_rows=STATEMENT_CHUNK_ROWS, ends=None):
+    return apply_stages(iter_statements(ingest_statements(file_paths, ends=ends), STATEMENT_COLUMNS, chunk_rows), enrich_data)
+
+# Enriched statements, enriching the typed statements chunk by chunk
+def enrich_statements(file_paths, ends=None):
+    data = concat_chunks(iter_enriched(file_paths, ends=ends))
+    # Each chunk is sorted on its own; statements are exported in date order and
+    # read earliest first, so this only sorts when statements overlap
+    if data is not None and not data['transaction_date'].is_monotonic_increasing:
+        data = data.sort_values(by='transaction_date', kind='stable')
+    return data
+
+# Enriched frames by lineage key (see lineage_key), shared by every caller in this process
+enriched_frames = LRUCache(ENRICHED_FRAMES_KEPT)
+
+# Key of the statements of a source (see storage.statement_files) enriched
+# incrementally: the source and the pipeline. The statements' content only
+# grows, and is checked against the digest in each export's watermark
+# instead; the rules they were classified by are kept with them
+def lineage_key(source):
+    return cache_key(os.path.abspath(source), PIPELINE_VERSION)
+
+# Watermark of an export read up to byte `end`, given the typed rows read: the
+# transaction date and serial number of its latest transaction, latest date
+# first, as serial numbers restart in exports merged from several, and the
+# content hash of the text before `end`
+def statement_watermark(path, statement, end, previous=None):
+    try:
+        dated = statement.loc[statement['transaction_date'].notna(), ['transaction_date', 'sl_no']]
+    except KeyError as error:
+        raise ValueError(f"Column 'Sl. No.' not found in {path}.") from error
+    watermark = dict(previous or {'transaction_date': None, 'sl_no': None})
+    if len(dated):
+        last = dated.sort_values(['transaction_date', 'sl_no']).iloc[-1]
+        last = (pd.Timestamp(last['transaction_date']), int(last['sl_no']))
+        if watermark['transaction_date'] is None or last > (pd.Timestamp(watermark['transaction_date']), watermark['sl_no']):
+            watermark['transaction_date'], watermark['sl_no'] = last[0].isoformat(), last[1]
+    watermark['end'] = end
+    watermark['digest'] = file_hash(path, end)
+    return watermark
+
+# Enriched statements with the watermark of each, by absolute path
+#
+# Each export is read up to its last complete line, which is where its
+# watermark ends; rows written meanwhile are left for read_appended_rows.
+def enrich_watermarked(file_paths):
+    ends = [complete_end(path) for path in file_paths]
+    data = enrich_statements(file_paths, ends)
+    watermarks = {}
+    for path, end in zip(file_paths, ends):
+        serials = load_statement(ingest_statement(path, end), ['sl_no', 'transaction_date'])
+        watermarks[os.path.abspath(path)] = statement_watermark(path, serials, end)
+    return data, watermarks
+
+# Typed rows appended to the exports since their `watermarks`, and their new
+# watermarks; None when an export was removed, shrank or changed before its watermark
+#
+# An export without a watermark is new and read whole. Every row after where
+# an export's text ended is new, whatever its date or serial number: exports
+# merged from several restart their serial numbers, and late-posted
+# transactions carry earlier dates. Enriching everything again would keep
+# them all too. A last line without its newline may still be being written,
+# so it is left for a later call.
+#
+# A change is told by hashing the text an export had, which is read again
+# only when the export was modified since it was last hashed, e.g. once per
+# append; that costs about 0.1 s per million rows, against minutes to enrich them.
+def read_appended_rows(file_paths, watermarks):
+    if set(watermarks) - {os.path.abspath(path) for path in file_paths}:
+        return None
+    chunks = []
+    new_watermarks = {}
+    for path in file_paths:
+        watermark = watermarks.get(os.path.abspath(path))
+        if watermark is not None:
+            size = os.path.getsize(path)
+            if size < watermark['end'] or file_hash(path, watermark['end']) != watermark.get('digest'):
+                return None
+            if size == watermark['end']:
+                new_watermarks[os.path.abspath(path)] = watermark
+                continue
+        rows, end = read_statement_tail(path, 0 if watermark is None else watermark['end'])
+        new_watermarks[os.path.abspath(path)] = statement_watermark(path, rows, end, watermark)
+        if len(rows):
+            chunks.append(rows[STATEMENT_COLUMNS])
+    rows = concat_chunks(chunks)
+    return (rows if rows is not None else pd.DataFrame(columns=STATEMENT_COLUMNS)), new_watermarks
+
+# Key of one version of statements enriched incrementally, see append_statements
+def appended_key(lineage, generation, rows):
+    return cache_key(lineage, generation, rows)
+
+# Indexes, search index and rollup cube of the statements at `old_key`,
+# extended with the rows of `data` from `start` on and kept under `new_key`
+#
+# Sessions still on the previous version keep using its structures, so each
+# is extended as a copy sharing its arrays (see e.g. TransactionIndex.copy).
+def extend_indexes(old_key, new_key, data, start):
+    for indexes in (transaction_indexes, search_indexes, rollup_cubes):
+        index = indexes.get(old_key)
+        if index is not None and index.rows_total == start:
+            index = index.copy()
+            index.extend(data, start)
+            indexes.put(new_key, index)
+
+# Indexes, search index and rollup cube of the statements at `old_key`, with
+# the classifications of the rows of `data` at `rows` changed, kept under `new_key`
+def update_indexes(old_key, new_key, data, rows):
+    for indexes in (transaction_indexes, search_indexes, rollup_cubes):
+        index = indexes.get(old_key)
+        if index is not None and index.rows_total == len(data):
+            index = index.copy()
+            index.update(data, rows)
+            indexes.put(new_key, index)
+
+# Enriched statements of `lineage` classified by the loaded rules, when the
+# rules changed since they were classified
+#
+# Only the rows the changed rules could affect are classified again (see
+# categorizer.reclassify). Their classifications are patched into a copy of
+# the frame, which starts a new generation, and the indexes, search index
+# and rollup cube of the previous one are updated to them (see update_indexes).
+def reclassify_statements(lineage, data):
+    with Stage('reclassify', len(data)) as reclassification:
+        rows, classifications = reclassify(data, rule_changes(data.attrs['rules']))
+        reclassification.rows_out = len(rows)
+    attrs = dict(data.attrs, rules=rule_specs())
+    if len(rows):
+        old_key = appended_key(lineage, attrs['generation'], len(data))
+        attrs['generation'] += 1
+        # Whole columns are replaced in a shallow copy, leaving the shared frame's data as it is
+        data = data.copy(deep=False)
+        for column in Classification._fields:
+            values = data[column].to_numpy(dtype=object, copy=True)
+            values[rows] = classifications[column].to_numpy(dtype=object)
+            data[column] = pd.Series(values, index=data.index, dtype=data[column].dtype)
+        update_indexes(old_key, appended_key(lineage, attrs['generation'], len(data)), data, rows)
+    data.attrs = attrs
+    store_appended_rows(lineage, data, 0 if len(rows) else len(data), data.attrs)
+    return data
+
+# Locks of the sources being loaded by append_statements, by lineage key
+lineage_locks = {}
+
+# Enriched statements of a source, enriching only the rows appended to its
+# exports since the last call, as (dataset key, enriched statements)
+#
+# Each export has a watermark: the transaction date and serial number
+# ('Sl. No.') of its latest transaction, and where its text ended. The rows
+# after that end are enriched on their own and appended to the enriched
+# statements, in memory and as a new part on disk, and the indexes, search
+# index and rollup cube built for the previous version are extended under the
+# new dataset key (see extend_indexes). A new export is read whole. An export
+# that was removed or rewritten, or the pipeline changing, enriches
+# everything again; rule edits only classify again the rows they could
+# affect (see reclassify_statements). New rows dated before the last
+# enriched one are merged in by date, and the indexes are then built again.
+#
+# One caller at a time loads each source; callers arriving meanwhile wait and
+# then find its result, so concurrent sessions never enrich the same rows twice.
+#
+# Every caller gets its own shallow copy of the shared frame, whose data is
+# never written to here. A caller writing to its copy needs copy-on-write,
+# the only mode from pandas 3 on, so the changes never reach the shared
+# frame or the copies of other callers, such as concurrent app sessions; the
+# app turns it on.
+def append_statements(source):
+    file_paths = statement_files(source)
+    if not file_paths:
+        return None, None
+    lineage = lineage_key(source)
+    with lineage_locks.setdefault(lineage, threading.Lock()):
+        data = enriched_frames.get(lineage)
+        if data is None:
+            data = load_appended_frame(lineage)
+        appended = None if data is None else read_appended_rows(file_paths, data.attrs['watermarks'])
+        if appended is not None and data.attrs['rules'] != rule_specs():
+            data = reclassify_statements(lineage, data)
+
+        if appended is None:
+            generation = 0 if data is None else data.attrs['generation'] + 1
+            data, watermarks = enrich_watermarked(file_paths)
+            if data is None:
+                return None, None
+            data.attrs = {'watermarks': watermarks, 'generation': generation, 'rules': rule_specs()}
+            store_appended_rows(lineage, data, 0, data.attrs)
+        elif len(appended[0]):
+            rows, watermarks = appended
+            generation = data.attrs['generation']
+            start = len(data)
+            rows.index = pd.RangeIndex(start, start + len(rows))
+            with Stage('append', len(rows)):
+                new_data = concat_chunks([data.copy(deep=False), enrich_data(rows)])
+            if new_data['transaction_date'].iloc[start - 1:].is_monotonic_increasing:
+                extend_indexes(appended_key(lineage, generation, start), appended_key(lineage, generation, len(new_data)), new_data, start)
+            else:
+                new_data = new_data.sort_values(by='transaction_date', kind='stable')
+                generation += 1
+                start = 0
+            data = new_data
+            data.attrs = {'watermarks': watermarks, 'generation': generation, 'rules': rule_specs()}
+            store_appended_rows(lineage, data, start, data.attrs)
+        elif appended[1] != data.attrs['watermarks']:
+            data.attrs['watermarks'] = appended[1]
+
+        enriched_frames.put(lineage, data)
+        frame = data.copy(deep=False)
+        frame.attrs = {}
+        return appended_key(lineage, data.attrs['generation'], len(data)), frame
+
+# Positions of the rows passing the sidebar's date range, amount, balance and credit/debit filters
+#
+# Like the amount slider, the balance slider caps the transaction amount.
+# `direction` is a credit_debit_value, 1 for credits and -1 for debits, or
+# None for every transaction. Rows are looked up in `index` (see
+# indexes.TransactionIndex); a date range alone comes back as a slice.
+def filter_rows(index, start_date, end_date, amount_limit, balance_limit, direction=None):
+    return index.rows(transaction_date=(start_date, end_date), amount=(None, min(amount_limit, balance_limit)),
+                      credit_debit_value=(direction, direction))
+
+# The sidebar's filters applied to `data`, building its index when not given
+def filter_transactions(data, start_date, end_date, amount_limit, balance_limit, index=None, direction=None):
+    if index is None:
+        index = TransactionIndex(data)
+    return data.iloc[filter_rows(index, start_date, end_date, amount_limit, balance_limit, direction)]
+
+# Transactions of `data` whose description, name or category match `keyword`
+#
+# See search.SearchIndex for the query syntax. `rows` restricts the search to
+# those positions, e.g. from filter_rows; the index is built when not given.
+# A `fuzzy` search also finds near-matches of the description or name, with
+# their similarity in a 'similarity' column; rows stay in frame order.
+def search_transactions(keyword, data, index=None, rows=None, fuzzy=False):
+    if index is None:
+        index = SearchIndex(data)
+    if not fuzzy:
+        return data.iloc[index.rows(keyword, rows)]
+    rows, similarity = index.similar_rows(keyword, rows)
+    return data.iloc[rows].assign(similarity=similarity)
+
+
+# Where in `keys` the rows of page `page` (from 0) are, sorting on `keys` with ties in their given order
+#
+# Only the page is sorted: a partition finds the keys at its first and last
+# row, so a page costs O(len(keys) + page_size log page_size).
+def sorted_page(keys, page, page_size, descending=False):
+    keys = np.asarray(keys, dtype=np.int64)
+    start = min(page * page_size, len(keys))
+    stop = min(start + page_size, len(keys))
+    if start == stop:
+        return np.zeros(0, dtype=np.int64)
+    if descending:
+        keys = keys.max() - keys
+    # Unique keys that sort like (key, position)
+    keys = keys * len(keys) + np.arange(len(keys))
+    first, last = np.partition(keys, [start, stop - 1])[[start, stop - 1]]
+    page_keys = np.sort(keys[(keys >= first) & (keys <= last)])
+    return page_keys % len(keys)
+
+# Positions as compact as they can be: slices as they are, arrays as int32 where they fit
+def compact_rows(rows):
+    if isinstance(rows, slice) or not len(rows) or rows[-1] >= 2**31:
+        return rows
+    return rows.astype(np.int32)
+
+# Rows of one filter state: passing the sliders, also matching the search,
+# shown in the table and drawn in the charts; the similarity of the table's
+# rows is kept for a fuzzy search. `state` is the filter cache key, which
+# caches of data derived from the rows can share
+class FilteredRows:
+
+    def __init__(self, filtered, searched, table, charts, similarity=None, state=None):
+        self.state = state
+        self.filtered = compact_rows(filtered)
+        self.searched = compact_rows(searched)
+        self.table = compact_rows(table)
+        self.charts = compact_rows(charts)
+        self.similarity = None if similarity is None else similarity.astype(np.float32)
+
+    # Memory held by the positions, counted against FILTER_CACHE_BYTES
+    @property
+    def nbytes(self):
+        parts = [self.filtered, self.searched, self.table, self.charts, self.similarity]
+        return sum(getattr(part, 'nbytes', 0) for part in parts)
+
+# FilteredRows by filter state, shared by every session
+filter_cache = LRUCache(FILTER_STATES_KEPT, FILTER_CACHE_BYTES)
+
+# FilteredRows of the sidebar's filters and search, cached by filter state
+#
+# `key` identifies the dataset (see append_statements), `index` and `search` are its
+# TransactionIndex and SearchIndex; see filter_rows for `direction`. The table keeps the searched rows with an
+# amount in `table_amounts`; the charts keep the table's rows with a balance
+# in `chart_balances`. A filter state seen before is a lookup of this small
+# tuple of values, which never touches the data.
+def filter_state_rows(key, index, search, start_date, end_date, amount_limit, balance_limit, direction=None,
+                      keyword='', fuzzy=False, table_amounts=(None, None), chart_balances=(None, None)):
+    state = (key, start_date, end_date, amount_limit, balance_limit, direction, keyword, fuzzy, table_amounts, chart_balances)
+    rows = filter_cache.get(state)
+    if rows is not None:
+        return rows
+
+    filtered = filter_rows(index, start_date, end_date, amount_limit, balance_limit, direction)
+    similarity = None
+    if not keyword:
+        searched = filtered
+    elif fuzzy:
+        searched, similarity = search.similar_rows(keyword, filtered)
+    else:
+        searched = search.rows(keyword, filtered)
+
+    table = searched
+    if table_amounts != (None, None):
+        positions = np.arange(searched.start, searched.stop) if isinstance(searched, slice) else searched
+        shown = index.indexes['amount'].contains(positions, *table_amounts)
+        table = positions[shown]
+        similarity = None if similarity is None else similarity[shown]
+    charts = table
+    if chart_balances != (None, None):
+        positions = np.arange(table.start, table.stop) if isinstance(table, slice) else table
+        charts = positions[index.indexes['balance'].contains(positions, *chart_balances)]
+
+    rows = FilteredRows(filtered, searched, table, charts, similarity, state)
+    filter_cache.put(state, rows)
+    return rows
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Enrich bank statement CSV exports into CSV or Parquet.')
+    parser.add_argument('statements', nargs='+', help='CSV exports, directories of exports or glob patterns')
+    parser.add_argument('--output', '-o', required=True, help='file to write; .csv or .parquet')
+    parser.add_argument('--format', choices=['csv', 'parquet'], help='output format; by default taken from the output file name')
+    parser.add_argument('--chunk-rows', type=int, default=STATEMENT_CHUNK_ROWS, help='rows enriched at a time')
+    parser.add_argument('--workers', type=int, default=0, help='worker processes classifying descriptions; 0 classifies in this process')
+    parser.add_argument('--group-by', nargs='+', metavar='COLUMN',
+                        help='write the sum and count of the --sum columns per group of these enriched columns instead of the rows')
+    parser.add_argument('--sum', nargs='+', default=['amount_paise'], metavar='COLUMN', help='columns totalled by --group-by')
+    parser.add_argument('--log-stages', action='store_true', help='log the timing of each stage to stderr as JSON lines')
+    args = parser.parse_args()
+
+    output_format = args.format or ('csv' if args.output.lower().endswith('.csv') else 'parquet')
+    file_paths = [path for source in args.statements for path in statement_files(source)]
+    if not file_paths:
+        parser.error('no statement files found')
+    if args.log_stages:
+        enable_stage_logging()
+    categorizer.CLASSIFY_WORKERS = args.workers
+
+    # Chunks are written or totalled as they are enriched, so memory stays bounded
+    # by the chunk size; statements that overlap in time are written one after another
+    output_directory = os.path.dirname(os.path.abspath(args.output))
+    os.makedirs(output_directory, exist_ok=True)
+    try:
+        # The extracted entity is only kept for classifying the rows again
+        chunks = (chunk.drop(columns='extracted_entity') for chunk in iter_enriched(file_paths, args.chunk_rows))
+        if args.group_by:
+            totals = aggregate_chunks(chunks, args.group_by, args.sum)
+            if totals is None:
+                raise ValueError('No transactions found in the statements.')
+            totals.columns = [f'{column}_{statistic}' for column, statistic in totals.columns]
+            chunks = [totals.reset_index()]
+        if output_format == 'csv':
+            write_csv_chunks(chunks, args.output)
+        else:
+            write_statement_chunks(chunks, args.output)
+    except ValueError as error:
+        parser.exit(1, f'{parser.prog}: error: {error}\n')
@@ -0,0 +1,241 @@
+# Rollup cube of an enriched statement for the distribution charts
+#
+# Transactions are counted, and their debits and credits summed, by month,
+# year, category, name, payment method and amount scale once per dataset
+# version. The charts group these cells further instead of grouping rows.
+#
+# No cell spans two runs of rows of the same month, and an enriched statement
+# is sorted by date, so a date range (a contiguous run of rows, see
+# indexes.TransactionIndex.rows) takes the cells of the months it covers whole
+# from the cube and only counts the rows of the months at its two ends. The
+# rows of any other filter are counted by the cell they fall in, which reads
+# one integer per row.
+import copy
+
+import numpy as np
+import pandas as pd
+
+from caching import LRUCache
+from indexes import INDEXES_KEPT
+
+# Columns the cube is grouped by; the amount scale colours the parallel categories chart
+CUBE_DIMENSIONS = ['transaction_month', 'transaction_year', 'transaction_category', 'transaction_names',
+                   'payment_method_acronym', 'amount_category_num']
+
+# Filter states whose cell totals are kept between reruns, and the memory they may take
+ROLLUP_STATES_KEPT = 64
+ROLLUP_CACHE_BYTES = 64 * 2**20
+
+
+# Transaction counts and debit and credit sums of an enriched statement by CUBE_DIMENSIONS
+class RollupCube:
+
+    def __init__(self, data):
+        self.rows_total = len(data)
+
+        # Runs of rows of the same month, one per month when dates are sorted
+        months, _ = pd.factorize(data['transaction_month'])
+        run_starts = np.flatnonzero(np.diff(months, prepend=-2))
+        runs = np.repeat(np.arange(len(run_starts)), np.diff(np.append(run_starts, len(months))))
+        self.run_offsets = np.append(run_starts, len(months))
+
+        # Cells in order of their first row, so the cells of a run of rows are a
+        # run of cells, and groups of cells come in the order value_counts would give ties
+        codes = {'run': runs}
+        self.dimension_values = {}
+        for column in CUBE_DIMENSIONS:
+            codes[column], values = pd.factorize(data[column])
+            self.dimension_values[column] = pd.Index(values)
+        groups = pd.DataFrame(codes).groupby(list(codes), sort=False)
+        cell_codes = groups.ngroup().to_numpy()
+        self.cell_codes = cell_codes.astype(np.int32) if len(cell_codes) < 2**31 else cell_codes
+
+        # Values of each cell, taken from its first row so the columns keep their types
+        counts = np.bincount(cell_codes, minlength=groups.ngroups)
+        first = np.argsort(cell_codes, kind='stable')[np.cumsum(counts) - counts]
+        self.cells = data[CUBE_DIMENSIONS].iloc[first].reset_index(drop=True)
+        self.cell_runs = runs[first]
+        self.cell_offsets = np.searchsorted(self.cell_runs, np.arange(len(run_starts) + 1))
+        # Code of each cell's value in every column, from 0, missing values included
+        self.dimension_codes = {column: codes[column][first] + 1 for column in CUBE_DIMENSIONS}
+        self.dimension_sizes = {column: len(self.dimension_values[column]) + 1 for column in CUBE_DIMENSIONS}
+
+        # Debits and credits of each row in paise, and the totals of every cell
+        amounts = data['amount_paise'].to_numpy()
+        directions = data['credit_debit_value'].to_numpy()
+        self.debits = np.where(directions < 0, amounts, 0)
+        self.credits = np.where(directions > 0, amounts, 0)
+        self.totals = self.count(np.arange(self.rows_total))
+
+    def __len__(self):
+        return len(self.cells)
+
+    # Count, debit paise and credit paise of each cell over the rows at `positions`, as an array of shape (3, cells)
+    def count(self, positions):
+        cells = self.cell_codes[positions]
+        return np.stack([
+            np.bincount(cells, minlength=len(self.cells)).astype(np.float64),
+            np.bincount(cells, weights=self.debits[positions], minlength=len(self.cells)),
+            np.bincount(cells, weights=self.credits[positions], minlength=len(self.cells)),
+        ])
+
+    # Totals of each cell over `rows`, a slice or sorted positions, see count
+    def row_totals(self, rows):
+        if not isinstance(rows, slice):
+            return self.count(rows)
+        start, stop = rows.start, rows.stop
+        if (start, stop) == (0, self.rows_total):
+            return self.totals
+
+        # Runs covered whole come from the cube; the rows of the runs at either end are counted
+        first = int(np.searchsorted(self.run_offsets, start, 'left'))
+        last = int(np.searchsorted(self.run_offsets, stop, 'right')) - 1
+        if first >= last:
+            return self.count(np.arange(start, stop))
+        totals = np.zeros_like(self.totals)
+        cells = slice(self.cell_offsets[first], self.cell_offsets[last])
+        totals[:, cells] = self.totals[:, cells]
+        ends = np.concatenate([np.arange(start, self.run_offsets[first]), np.arange(self.run_offsets[last], stop)])
+        return totals + self.count(ends)
+
+    # Copy sharing the arrays, so extending or updating it leaves this cube as
+    # it is for those still rolling up the rows it was built on
+    def copy(self):
+        cube = copy.copy(self)
+        cube.dimension_values = dict(self.dimension_values)
+        cube.dimension_codes = dict(self.dimension_codes)
+        cube.dimension_sizes = dict(self.dimension_sizes)
+        return cube
+
+    # Code of each of `values` in `column`, from 1 with 0 for missing values,
+    # numbering values not seen before after the others
+    def value_codes(self, column, values):
+        found = self.dimension_values[column].get_indexer(values)
+        unseen = (found < 0) & pd.notna(values)
+        added_codes, added = pd.factorize(values[unseen])
+        found[unseen] = added_codes + len(self.dimension_values[column])
+        self.dimension_values[column] = self.dimension_values[column].append(pd.Index(added))
+        self.dimension_sizes[column] = len(self.dimension_values[column]) + 1
+        return found + 1
+
+    # Roll up the rows of `data` from position `start` on, appended since the cube was built
+    #
+    # Rows continuing the last month join its run, and its cells where they
+    # match one; other rows start new runs and cells after the existing ones.
+    # Only the new rows are grouped. The arrays are replaced, never written to.
+    def extend(self, data, start):
+        appended = data.iloc[start:]
+        months = pd.factorize(appended['transaction_month'])[0]
+        run_starts = np.flatnonzero(np.diff(months, prepend=-2))
+        runs = np.repeat(np.arange(len(run_starts)), np.diff(np.append(run_starts, len(months)))) + len(self.run_offsets) - 1
+        last_month = data['transaction_month'].iloc[start - 1:start + 1].to_numpy()
+        if start and len(appended) and (last_month[0] == last_month[1] or pd.isna(last_month).all()):
+            runs -= 1
+            run_starts = run_starts[1:]
+        self.run_offsets = np.concatenate([self.run_offsets[:-1], run_starts + start, [len(data)]])
+
+        # Codes of the new rows' values
+        codes = {'run': runs, **{column: self.value_codes(column, appended[column].to_numpy()) for column in CUBE_DIMENSIONS}}
+
+        # Cells of the new rows, matched with the cells of the last run
+        groups = pd.DataFrame(codes).groupby(list(codes), sort=False)
+        group_codes = groups.ngroup().to_numpy()
+        keys = groups.size().index.to_frame(index=False)
+        last_cells = np.arange(self.cell_offsets[-2] if len(self.cell_offsets) > 1 else 0, len(self.cells))
+        existing = pd.DataFrame({'run': self.cell_runs[last_cells], **{column: self.dimension_codes[column][last_cells]
+                                                                       for column in CUBE_DIMENSIONS}, 'cell': last_cells})
+        cells = keys.merge(existing, how='left', on=list(codes))['cell'].to_numpy(dtype=np.float64, copy=True)
+        added = np.isnan(cells)
+        cells[added] = len(self.cells) + np.arange(int(added.sum()))
+        cells = cells.astype(np.int64)
+
+        # The new cells, in order of their first row
+        first = np.flatnonzero(np.diff(np.maximum.accumulate(group_codes), prepend=-1) > 0)[added]
+        self.cells = pd.concat([self.cells, appended[CUBE_DIMENSIONS].iloc[first]], ignore_index=True)
+        self.cell_runs = np.concatenate([self.cell_runs, runs[first]])
+        self.cell_offsets = np.searchsorted(self.cell_runs, np.arange(len(self.run_offsets)))
+        for column in CUBE_DIMENSIONS:
+            self.dimension_codes[column] = np.concatenate([self.dimension_codes[column], codes[column][first]])
+
+        cell_codes = cells[group_codes]
+        self.cell_codes = np.concatenate([self.cell_codes, cell_codes.astype(self.cell_codes.dtype)])
+        amounts = appended['amount_paise'].to_numpy()
+        directions = appended['credit_debit_value'].to_numpy()
+        self.debits = np.concatenate([self.debits, np.where(directions < 0, amounts, 0)])
+        self.credits = np.concatenate([self.credits, np.where(directions > 0, amounts, 0)])
+        self.rows_total = len(data)
+        self.totals = np.pad(self.totals, ((0, 0), (0, len(self.cells) - self.totals.shape[1]))) + self.count(np.arange(start, len(data)))
+
+    # Roll up the rows of `data` at `rows`, sorted positions whose names or
+    # categories changed since the cube was built
+    #
+    # The runs from the first to the last of the rows are grouped again, and
+    # their cells replace those the runs had, keeping every cell in order of
+    # its first row. The arrays are replaced, never written to.
+    def update(self, data, rows):
+        first_run, last_run = np.searchsorted(self.run_offsets, [rows[0], rows[-1]], 'right') - 1
+        start, stop = self.run_offsets[first_run], self.run_offsets[last_run + 1]
+        first_cell, stop_cell = self.cell_offsets[first_run], self.cell_offsets[last_run + 1]
+        runs = np.repeat(np.arange(first_run, last_run + 1), np.diff(self.run_offsets[first_run:last_run + 2]))
+        span = data.iloc[start:stop]
+        codes = {'run': runs, **{column: self.value_codes(column, span[column].to_numpy()) for column in CUBE_DIMENSIONS}}
+        groups = pd.DataFrame(codes).groupby(list(codes), sort=False)
+        group_codes = groups.ngroup().to_numpy()
+        counts = np.bincount(group_codes, minlength=groups.ngroups)
+        first = np.argsort(group_codes, kind='stable')[np.cumsum(counts) - counts]
+
+        self.cells = pd.concat([self.cells.iloc[:first_cell], span[CUBE_DIMENSIONS].iloc[first], self.cells.iloc[stop_cell:]],
+                               ignore_index=True)
+        self.cell_runs = np.concatenate([self.cell_runs[:first_cell], runs[first], self.cell_runs[stop_cell:]])
+        self.cell_offsets = np.searchsorted(self.cell_runs, np.arange(len(self.run_offsets)))
+        for column in CUBE_DIMENSIONS:
+            previous = self.dimension_codes[column]
+            self.dimension_codes[column] = np.concatenate([previous[:first_cell], codes[column][first], previous[stop_cell:]])
+
+        shift = groups.ngroups - (stop_cell - first_cell)
+        self.cell_codes = np.concatenate([self.cell_codes[:start], (group_codes + first_cell).astype(self.cell_codes.dtype),
+                                          self.cell_codes[stop:] + shift])
+        self.totals = np.concatenate([self.totals[:, :first_cell], np.zeros((3, groups.ngroups)), self.totals[:, stop_cell:]],
+                                     axis=1) + self.count(np.arange(start, stop))
+
+    # Cell totals rolled up by `dimensions`, as a frame of those columns with
+    # 'count', 'debit', 'credit' and 'net' in rupees, in order of first cell;
+    # empty groups are left out
+    def rollup(self, totals, dimensions):
+        present = np.flatnonzero(totals[0] > 0)
+        # One key per combination of values, packing the codes of the columns
+        keys = np.zeros(len(present), dtype=np.int64)
+        for column in dimensions:
+            keys = keys * self.dimension_sizes[column] + self.dimension_codes[column][present]
+        groups, group_keys = pd.factorize(keys)
+        first = np.zeros(len(group_keys), dtype=np.int64)
+        first[groups[::-1]] = np.arange(len(groups))[::-1]
+        sums = [np.bincount(groups, weights=totals[i, present], minlength=len(group_keys)) for i in range(3)]
+        frame = self.cells[dimensions].iloc[present[first]].reset_index(drop=True)
+        frame['count'] = sums[0].astype(np.int64)
+        frame['debit'] = sums[1] / 100
+        frame['credit'] = sums[2] / 100
+        frame['net'] = (sums[2] - sums[1]) / 100
+        return frame
+
+# Cubes by dataset key, as returned by pipeline.append_statements
+rollup_cubes = LRUCache(INDEXES_KEPT)
+
+# Rollup cube of an enriched statement, built on first use for each dataset key
+def rollup_cube(key, data):
+    cube = rollup_cubes.get(key)
+    if cube is None or cube.rows_total != len(data):
+        cube = RollupCube(data)
+        rollup_cubes.put(key, cube)
+    return cube
+
+# Cell totals by filter state
+cell_totals = LRUCache(ROLLUP_STATES_KEPT, ROLLUP_CACHE_BYTES)
+
+# Totals of each cell of `cube` over `rows` for a filter state, see RollupCube.row_totals
+def cached_row_totals(state, cube, rows):
+    totals = cell_totals.get(state)
+    if totals is None:
+        totals = cube.row_totals(rows)
+        cell_totals.put(state, totals)
+    return totals
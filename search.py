@@ -0,0 +1,369 @@
+# Word index over the descriptions, names and categories of an enriched statement
+#
+# Names and categories are classified from the description (see
+# categorizer.enrich_descriptions), so every distinct description has one name
+# and one category. Each column's distinct values are split into lowercase
+# words, which map to the values holding them; each distinct description maps
+# to its rows. The index is sized by distinct values rather than by rows.
+#
+# A query is a list of words, all of which must match (AND). A word matches
+# the start of any word in the three fields, so results update as the word is
+# typed; a word in double quotes matches whole words only. Words are found by
+# binary search over the sorted vocabulary, and a selective search gathers the
+# rows of its matching descriptions without looking at any other row.
+#
+# Fuzzy search tolerates the truncated and run-together counterparties of bank
+# descriptions, e.g. 'BhartiAirte' or 'rentomojorazorp'. Letters and digits
+# of the query and of each distinct description and name are compared as
+# trigrams; a value is as similar to the query as the share of the query's
+# trigrams it holds.
+import copy
+import re
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from caching import LRUCache
+from indexes import INDEXES_KEPT, row_count
+
+# Columns searched, all determined by the description
+SEARCH_COLUMNS = ['description', 'transaction_names', 'transaction_category']
+
+# Runs of characters between words, in the RE2 syntax of pyarrow
+WORD_SEPARATORS = r'[^\p{L}\p{N}]+'
+
+# Sorts after every word starting with a given prefix
+PREFIX_END = '\U0010ffff'
+
+# Columns compared by fuzzy search, and the similarity a match needs at least
+FUZZY_COLUMNS = ['description', 'transaction_names']
+FUZZY_MIN_SIMILARITY = 0.6
+
+# Segments a column's word or trigram index may grow to as rows are appended
+# (see SearchIndex.extend); beyond it, the appended segments are merged
+INDEX_SEGMENTS_KEPT = 8
+
+
+# Lowercase words of each value, as (words, position of the value each word came from)
+def split_words(values):
+    values = pa.array(np.asarray(values, dtype=object), type=pa.large_string(), from_pandas=True)
+    words = pc.split_pattern_regex(pc.utf8_lower(values), WORD_SEPARATORS)
+    sources = pc.list_parent_indices(words).to_numpy()
+    words = pc.list_flatten(words)
+    present = pc.not_equal(words, '').to_numpy(zero_copy_only=False)
+    return words.filter(pa.array(present)), sources[present]
+
+# Trigrams of the letters and digits of each value, lowercased, as (trigram codes, position of the value each came from)
+#
+# Trigrams are taken over UTF-8 bytes, which for the ASCII text of bank
+# descriptions are its characters; a code packs the three bytes into an int.
+def trigram_codes(values):
+    values = pa.array(np.asarray(values, dtype=object), type=pa.large_string(), from_pandas=True)
+    text = pc.replace_substring_regex(pc.utf8_lower(values), WORD_SEPARATORS, '').fill_null('')
+    text = pa.concat_arrays([text]) if text.offset else text
+    offsets = np.frombuffer(text.buffers()[1], dtype=np.int64, count=len(text) + 1)
+    counts = np.maximum(np.diff(offsets) - 2, 0)
+    total = int(counts.sum())
+    if not total:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    sources = np.repeat(np.arange(len(text)), counts)
+    starts = np.repeat(offsets[:-1] - np.cumsum(counts) + counts, counts) + np.arange(total)
+    data = np.frombuffer(text.buffers()[2], dtype=np.uint8).astype(np.int64)
+    return (data[starts] << 16) | (data[starts + 1] << 8) | data[starts + 2], sources
+
+# Words of a query as (word, exact) pairs; quoted words are matched exactly
+def query_terms(query):
+    terms = []
+    for quoted, plain in re.findall(r'"([^"]*)"?|(\S+)', query):
+        words, _ = split_words([quoted or plain])
+        terms.extend((word, bool(quoted)) for word in words.to_pylist())
+    return terms
+
+# Lowercase words of distinct values, and the values holding each word
+class WordIndex:
+
+    def __init__(self, values):
+        words, sources = split_words(values)
+        words = words.dictionary_encode()
+
+        # Sorted vocabulary, and the values holding each word in a run of value_ids
+        vocabulary_order = pc.array_sort_indices(words.dictionary).to_numpy()
+        self.words = words.dictionary.take(pa.array(vocabulary_order)).to_numpy(zero_copy_only=False)
+        ranks = np.empty_like(vocabulary_order)
+        ranks[vocabulary_order] = np.arange(len(vocabulary_order))
+        values_total = max(len(values), 1)
+        pairs = np.sort(ranks[words.indices.to_numpy()].astype(np.int64) * values_total + sources)
+        pairs = pairs[np.concatenate([[True], pairs[1:] != pairs[:-1]])]
+        self.value_ids = pairs % values_total
+        self.word_offsets = np.searchsorted(pairs // values_total, np.arange(len(self.words) + 1))
+        self.values_total = len(values)
+
+    # Which values hold a word starting with `word`, or equal to it when `exact`
+    #
+    # The mask has an extra, unset slot for missing values, whose code is -1.
+    def matching(self, word, exact=False):
+        start = np.searchsorted(self.words, word, 'left')
+        stop = np.searchsorted(self.words, word if exact else word + PREFIX_END, 'right')
+        matches = np.zeros(self.values_total + 1, dtype=bool)
+        matches[self.value_ids[self.word_offsets[start]:self.word_offsets[stop]]] = True
+        return matches
+
+
+# Trigrams of distinct values, and the values holding each trigram
+class TrigramIndex:
+
+    def __init__(self, values):
+        codes, sources = trigram_codes(values)
+        values_total = max(len(values), 1)
+        pairs = np.sort(codes * values_total + sources)
+        pairs = pairs[np.concatenate([[True], pairs[1:] != pairs[:-1]])]
+        trigrams = pairs // values_total
+        first = np.concatenate([[True], trigrams[1:] != trigrams[:-1]])
+        self.trigrams = trigrams[first]
+        self.trigram_offsets = np.append(np.flatnonzero(first), len(pairs))
+        self.value_ids = pairs % values_total
+        self.values_total = len(values)
+
+    # Share of the distinct `query_trigrams` each value holds
+    #
+    # Only the values sharing a trigram with the query are visited. The result
+    # has an extra slot, always 0, for missing values, whose code is -1.
+    def similarity(self, query_trigrams):
+        found = np.minimum(np.searchsorted(self.trigrams, query_trigrams), max(len(self.trigrams) - 1, 0))
+        found = found[self.trigrams[found] == query_trigrams] if len(self.trigrams) else found[:0]
+        holders = [self.value_ids[self.trigram_offsets[i]:self.trigram_offsets[i + 1]] for i in found]
+        shared = np.bincount(np.concatenate(holders) if holders else np.zeros(0, dtype=np.int64), minlength=self.values_total + 1)
+        return shared / len(query_trigrams)
+
+
+# Distinct values of one searched column, with their word and trigram indexes
+#
+# Values are held in segments: those indexed at first, then those added by
+# each SearchIndex.extend, so appending never splits or hashes the values
+# indexed before. Beyond INDEX_SEGMENTS_KEPT segments, all but the first are merged.
+class ColumnIndex:
+
+    def __init__(self, values):
+        self.segments = []
+        self.words = []
+        # Trigram indexes of the segments, built on the first fuzzy search
+        self.trigrams = None
+        self.append(values)
+
+    def __len__(self):
+        return sum(len(segment) for segment in self.segments)
+
+    # Copy sharing the segments, so appending to it leaves this column as it is
+    def copy(self):
+        column = copy.copy(self)
+        column.segments = list(self.segments)
+        column.words = list(self.words)
+        column.trigrams = None if self.trigrams is None else list(self.trigrams)
+        return column
+
+    # Position of each of `values` among the column's values, or -1 for values it doesn't hold
+    def codes(self, values):
+        codes = np.full(len(values), -1, dtype=np.int64)
+        offset = 0
+        for segment in self.segments:
+            found = segment.get_indexer(values)
+            codes[found >= 0] = found[found >= 0] + offset
+            offset += len(segment)
+        return codes
+
+    # Add distinct `values` the column doesn't hold yet, after the others
+    def append(self, values):
+        if self.segments and not len(values):
+            return
+        self.segments.append(pd.Index(values, dtype=object))
+        self.words.append(WordIndex(values))
+        if self.trigrams is not None:
+            self.trigrams.append(TrigramIndex(values))
+        if len(self.segments) > INDEX_SEGMENTS_KEPT:
+            merged = np.concatenate([segment.to_numpy() for segment in self.segments[1:]])
+            self.segments = [self.segments[0], pd.Index(merged, dtype=object)]
+            self.words = [self.words[0], WordIndex(merged)]
+            if self.trigrams is not None:
+                self.trigrams = [self.trigrams[0], TrigramIndex(merged)]
+
+    # Codes of `values`, adding those the column doesn't hold yet after the others; missing values get -1
+    def add(self, values):
+        codes = self.codes(values)
+        unseen = (codes < 0) & pd.notna(values)
+        added_codes, added = pd.factorize(values[unseen])
+        codes[unseen] = added_codes + len(self)
+        self.append(added)
+        return codes
+
+    # Which values hold a word starting with `word`, see WordIndex.matching
+    def matching(self, word, exact=False):
+        return np.concatenate([words.matching(word, exact)[:-1] for words in self.words] + [[False]])
+
+    # Share of the distinct `query_trigrams` each value holds, see TrigramIndex.similarity
+    def similarity(self, query_trigrams):
+        if self.trigrams is None:
+            self.trigrams = [TrigramIndex(segment) for segment in self.segments]
+        return np.concatenate([trigrams.similarity(query_trigrams)[:-1] for trigrams in self.trigrams] + [[0.0]])
+
+
+# Words of the searched columns, with the rows of the descriptions holding them
+class SearchIndex:
+
+    def __init__(self, data):
+        self.rows_total = len(data)
+        # Rows with no description are never found
+        codes, descriptions = pd.factorize(data['description'])
+        self.codes = codes
+
+        # Rows of each distinct description, in frame order
+        order = np.argsort(codes, kind='stable')
+        counts = np.bincount(codes[codes >= 0], minlength=len(descriptions))
+        self.description_rows = order[len(codes) - counts.sum():]
+        self.description_offsets = np.concatenate([[0], np.cumsum(counts)])
+
+        # Distinct values of each column, and the value of each distinct
+        # description's first row among them
+        first = self.description_rows[self.description_offsets[:-1]]
+        self.values = {'description': np.arange(len(descriptions))}
+        self.columns = {'description': ColumnIndex(descriptions)}
+        for column in SEARCH_COLUMNS[1:]:
+            self.values[column], values = pd.factorize(data[column].to_numpy()[first])
+            self.columns[column] = ColumnIndex(values)
+
+    # Which distinct descriptions match `word` in any searched column
+    #
+    # The mask has an extra, unset slot for rows with no description, whose code is -1.
+    def matching_descriptions(self, word, exact=False):
+        matches = np.zeros(len(self.description_offsets), dtype=bool)
+        for column, values in self.columns.items():
+            matches[:-1] |= values.matching(word, exact)[self.values[column]]
+        return matches
+
+    # Positions of the rows matching every word of `query`, in frame order
+    #
+    # `within` (a slice or sorted positions, e.g. indexes.TransactionIndex.rows)
+    # restricts the search to those rows. An empty query matches every row.
+    def rows(self, query, within=None):
+        if within is None:
+            within = slice(0, self.rows_total)
+        terms = query_terms(query)
+        if not terms:
+            return within
+
+        selected = self.matching_descriptions(*terms[0])
+        for word, exact in terms[1:]:
+            selected &= self.matching_descriptions(word, exact)
+
+        return self.selected_rows(selected, within)
+
+    # Positions of the rows of the `selected` distinct descriptions among `within`, in frame order
+    def selected_rows(self, selected, within):
+        descriptions = np.flatnonzero(selected)
+        starts = self.description_offsets[descriptions]
+        counts = self.description_offsets[descriptions + 1] - starts
+        total = int(counts.sum())
+        candidates = row_count(within)
+
+        # Few matches: gather the rows of the matching descriptions and keep those within
+        if total * 8 < candidates:
+            rows = self.description_rows[np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(total)]
+            rows.sort()
+            if isinstance(within, slice):
+                return rows[(rows >= within.start) & (rows < within.stop)]
+            found = np.minimum(np.searchsorted(within, rows), max(len(within) - 1, 0))
+            return rows[within[found] == rows] if len(within) else rows[:0]
+
+        # Many matches: check the description of every row within
+        positions = np.arange(within.start, within.stop) if isinstance(within, slice) else np.asarray(within)
+        return positions[selected[self.codes[positions]]]
+
+    # Positions of the rows whose description or name is similar to `query`, in frame order, and their similarity
+    #
+    # A description's similarity is the higher of its own and its name's.
+    # Queries too short to have a trigram fall back to rows(), at similarity 1.
+    def similar_rows(self, query, within=None):
+        if within is None:
+            within = slice(0, self.rows_total)
+        query_trigrams = np.unique(trigram_codes([query])[0])
+        if not len(query_trigrams):
+            rows = self.rows(query, within)
+            rows = np.arange(rows.start, rows.stop) if isinstance(rows, slice) else rows
+            return rows, np.ones(len(rows))
+
+        similarity = np.zeros(len(self.description_offsets))
+        for column in FUZZY_COLUMNS:
+            column_similarity = self.columns[column].similarity(query_trigrams)
+            similarity[:-1] = np.maximum(similarity[:-1], column_similarity[self.values[column]])
+
+        rows = self.selected_rows(similarity >= FUZZY_MIN_SIMILARITY, within)
+        return rows, similarity[self.codes[rows]]
+
+
+    # Copy sharing the arrays, so extending or updating it leaves this index as
+    # it is for those still searching the rows it was built on
+    def copy(self):
+        index = copy.copy(self)
+        index.values = dict(self.values)
+        index.columns = {column: values.copy() for column, values in self.columns.items()}
+        return index
+
+    # Index the rows of `data` from position `start` on, appended since the index was built
+    #
+    # New rows join the rows of their description. Values not seen before get
+    # codes after the existing ones, and only they are split into words. The
+    # arrays are replaced, never written to.
+    def extend(self, data, start):
+        appended = data.iloc[start:]
+        descriptions = self.columns['description']
+        new_descriptions = appended['description'].to_numpy()
+        codes = descriptions.codes(new_descriptions)
+        unseen = (codes < 0) & pd.notna(new_descriptions)
+        added_codes, added = pd.factorize(new_descriptions[unseen])
+        codes[unseen] = added_codes + len(descriptions)
+        descriptions.append(added)
+        self.codes = np.concatenate([self.codes, codes])
+
+        # New rows go at the end of their description's rows, which are all before them
+        present = np.flatnonzero(codes >= 0)
+        order = np.argsort(codes[present], kind='stable')
+        row_codes = codes[present][order]
+        offsets = np.concatenate([self.description_offsets, np.repeat(self.description_offsets[-1], len(added))])
+        self.description_rows = np.insert(self.description_rows, offsets[row_codes + 1], present[order] + start)
+        counts = np.bincount(row_codes, minlength=len(offsets) - 1)
+        self.description_offsets = offsets + np.concatenate([[0], np.cumsum(counts)])
+
+        # Values of the new descriptions' first rows; factorize numbers them in order of first appearance
+        first = np.flatnonzero(unseen)[np.flatnonzero(np.diff(np.maximum.accumulate(added_codes), prepend=-1) > 0)]
+        self.values['description'] = np.arange(len(offsets) - 1)
+        for column in SEARCH_COLUMNS[1:]:
+            found = self.columns[column].add(appended[column].to_numpy()[first])
+            self.values[column] = np.concatenate([self.values[column], found])
+        self.rows_total = len(data)
+
+    # Index the values of the rows of `data` at `rows`, whose names or
+    # categories changed since the index was built
+    #
+    # Every row of a description has its values, so the descriptions keep
+    # their rows and only their values are looked up again. The arrays are
+    # replaced, never written to.
+    def update(self, data, rows):
+        descriptions, first = np.unique(self.codes[rows], return_index=True)
+        first = rows[first[descriptions >= 0]]
+        descriptions = descriptions[descriptions >= 0]
+        for column in SEARCH_COLUMNS[1:]:
+            codes = self.values[column].copy()
+            codes[descriptions] = self.columns[column].add(data[column].to_numpy()[first])
+            self.values[column] = codes
+
+# Search indexes by dataset key, as returned by pipeline.append_statements
+search_indexes = LRUCache(INDEXES_KEPT)
+
+# Search index of an enriched statement, built on first use for each dataset key
+def search_index(key, data):
+    index = search_indexes.get(key)
+    if index is None or index.rows_total != len(data):
+        index = SearchIndex(data)
+        search_indexes.put(key, index)
+    return index
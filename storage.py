@@ -0,0 +1,306 @@
+# Typed columnar storage for bank statements
+#
+# Statement exports are CSV files where every value is text. ingest_statement
+# parses one with explicit dtypes into typed columns (dates, money as integer
+# paise, categorical Dr/Cr flags) and stores it as Parquet, so later loads skip
+# the text parsing and read only the columns a view needs.
+#
+# Statements are converted and read back in chunks of STATEMENT_CHUNK_ROWS rows,
+# so memory use while ingesting is bounded by the chunk size rather than the
+# size of the export. Chunks flow through generators: read_statement_chunks
+# normalizes a CSV chunk by chunk, apply_stages runs further steps such as
+# enrichment on each chunk, and write_statement_chunks, write_csv_chunks or
+# aggregate_chunks consume them.
+#
+# Several statements, e.g. one export per month or per account, are converted
+# in parallel on a process pool by ingest_statements and read back as one
+# stream in date order by iter_statements.
+#
+# An export that grows by appending rows can be read from where an earlier
+# read ended with read_statement_tail, see pipeline.append_statements. Such
+# reads stop after the last complete line (see complete_end), as a line
+# without its newline may still be being written.
+import glob
+import io
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from caching import file_hash, remove_oldest, temporary_file_path
+from instrumentation import timed
+from workers import can_fork, fork_pool
+
+# Directory holding typed statements converted from CSV
+STATEMENT_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache', 'statements')
+
+# Bump when the typed layout changes, so statements converted by older code are redone
+STATEMENT_FORMAT_VERSION = 2
+
+# Converted statements kept besides those just ingested; each version of an
+# export that was rewritten or grew is converted anew, so older ones are removed
+STATEMENTS_KEPT = 32
+
+# Rows per chunk when converting and streaming statements
+STATEMENT_CHUNK_ROWS = 100_000
+
+# Worker processes converting statements in parallel; None uses one per core
+INGEST_WORKERS = None
+
+# Typed columns of a statement; money is stored as f'{column}_paise'
+DATE_COLUMNS = ['transaction_date', 'value_date']
+MONEY_COLUMNS = ['amount', 'balance']
+
+# Format of the dates in statement exports, e.g. 21/08/2018 or 1/9/2018; some
+# exports switch to dashes part-way through, e.g. 23-07-2024
+DATE_FORMAT = '%d/%m/%Y'
+DASHED_DATE_FORMAT = '%d-%m-%Y'
+
+# dtypes of the CSV export columns, by their header
+CSV_DTYPES = {
+    'Sl. No.': 'int64',
+    'Transaction Date': 'str',
+    'Value Date': 'str',
+    'Description': 'str',
+    'Chq / Ref No.': 'str',
+    'Amount': 'float64',
+    'Dr / Cr': 'category',
+    'Balance': 'float64',
+    'Dr / Cr.1': 'category',
+}
+
+
+# Formatting column names
+def normalize_column_names(columns):
+    return (columns.str.replace(' ', '_')
+                   .str.replace('-', '_')
+                   .str.replace('/', '_')
+                   .str.replace('.', '')
+                   .str.lower())
+
+# Replace money columns parsed as rupees with exact int64 paise columns
+#
+# Statement amounts carry at most two decimals, so rounding the float rupee
+# value times 100 recovers the exact paise for any balance below 10^13 rupees.
+@timed('clean_columns')
+def clean_columns(data, columns):
+    for column in columns:
+        paise = np.rint(data[column].to_numpy(dtype='float64') * 100).astype('int64')
+        data.insert(data.columns.get_loc(column), f'{column}_paise', paise)
+        data = data.drop(columns=column)
+    return data
+
+# Dates in DATE_FORMAT, falling back to DASHED_DATE_FORMAT only for the rows that need it
+def parse_dates(values):
+    dates = pd.to_datetime(values, format=DATE_FORMAT, errors='coerce')
+    retry = dates.isna() & values.notna()
+    if retry.any():
+        dates[retry] = pd.to_datetime(values[retry], format=DASHED_DATE_FORMAT)
+    return dates
+
+# Typed statement from the raw columns of a CSV export, raising ValueError for unparseable dates
+def normalize_statement(statement):
+    statement.columns = normalize_column_names(statement.columns)
+
+    for col in DATE_COLUMNS:
+        try:
+            statement[col] = parse_dates(statement[col])
+        except ValueError as error:
+            raise ValueError(f"Error parsing dates in column {col}. Ensure dates are in 'dd/mm/yyyy' format.") from error
+
+    return clean_columns(statement, MONEY_COLUMNS)
+
+# Byte just past the last newline of a file, 0 when it has none
+def complete_end(path, block_size=1 << 16):
+    with open(path, 'rb') as file:
+        end = file.seek(0, os.SEEK_END)
+        while end > 0:
+            start = max(end - block_size, 0)
+            file.seek(start)
+            found = file.read(end - start).rfind(b'\n')
+            if found >= 0:
+                return start + found + 1
+            end = start
+    return 0
+
+# The first `end` bytes of a file, read as a binary stream
+class FilePrefix(io.RawIOBase):
+
+    def __init__(self, path, end):
+        self.file = open(path, 'rb')
+        self.remaining = end
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        block = self.file.read(min(len(buffer), self.remaining))
+        buffer[:len(block)] = block
+        self.remaining -= len(block)
+        return len(block)
+
+    def close(self):
+        self.file.close()
+        super().close()
+
+# Typed chunks of at most `chunk_rows` rows from a CSV export, or from its first `end` bytes
+def read_statement_chunks(path, chunk_rows=STATEMENT_CHUNK_ROWS, end=None):
+    source = path if end is None else io.BufferedReader(FilePrefix(path, end))
+    try:
+        with pd.read_csv(source, dtype=CSV_DTYPES, thousands=',', chunksize=chunk_rows) as reader:
+            for chunk in reader:
+                yield normalize_statement(chunk)
+    finally:
+        if end is not None:
+            source.close()
+
+# Typed rows of a CSV export from byte `offset` on, and the byte they end at
+#
+# `offset` is where an earlier read ended, so the rows are those appended
+# since; 0 reads the whole export. The header is taken from the first line.
+# The rows end with the last complete line; the rest is left for a later read.
+def read_statement_tail(path, offset=0):
+    with open(path, 'rb') as file:
+        header = file.readline()
+        file.seek(max(offset, len(header)))
+        text = file.read()
+    text = text[:text.rfind(b'\n') + 1]
+    end = max(offset, len(header)) + len(text)
+    return normalize_statement(pd.read_csv(io.BytesIO(header + text), dtype=CSV_DTYPES, thousands=',')), end
+
+# Chunks passed through each stage in turn; a stage takes and returns a frame
+def apply_stages(chunks, *stages):
+    for chunk in chunks:
+        for stage in stages:
+            chunk = stage(chunk)
+        yield chunk
+
+# Write chunks to one Parquet file, one row group per chunk, holding a single chunk in memory
+def write_statement_chunks(chunks, path):
+    writer = None
+    # Write to a temporary file first so readers never see a partial statement
+    temporary_path = temporary_file_path(path)
+    try:
+        for chunk in chunks:
+            if writer is None:
+                schema = pa.Schema.from_pandas(chunk, preserve_index=False)
+                writer = pq.ParquetWriter(temporary_path, schema)
+            # Categories differ between chunks, so every chunk is cast to the first chunk's schema
+            writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=False))
+        if writer is None:
+            raise ValueError(f"No transactions found in {path}.")
+        writer.close()
+        os.replace(temporary_path, path)
+    except BaseException:
+        if writer is not None:
+            writer.close()
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+        raise
+    return path
+
+# Write chunks to one CSV file with a single header, holding a single chunk in memory
+def write_csv_chunks(chunks, path):
+    written = False
+    # Write to a temporary file first so readers never see a partial file
+    temporary_path = temporary_file_path(path)
+    try:
+        for chunk in chunks:
+            chunk.to_csv(temporary_path, mode='a' if written else 'w', header=not written, index=False)
+            written = True
+        if not written:
+            raise ValueError(f"No transactions found in {path}.")
+        os.replace(temporary_path, path)
+    except BaseException:
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+        raise
+    return path
+
+# Sum and count of `values` per group of `by`, combining the partial result of each chunk
+#
+# Only the running totals are kept, so memory grows with the number of groups
+# rather than the number of rows.
+def aggregate_chunks(chunks, by, values):
+    totals = None
+    for chunk in chunks:
+        try:
+            partial = chunk.groupby(by, observed=True)[values].agg(['sum', 'count'])
+        except KeyError as error:
+            raise ValueError(f"Column {error} not found in the statements.") from error
+        totals = partial if totals is None else pd.concat([totals, partial]).groupby(level=by, observed=True).sum()
+    return totals
+
+# Concatenate chunks, keeping their row labels and merging the categories each
+# chunk saw so categoricals stay categorical
+def concat_chunks(chunks):
+    chunks = list(chunks)
+    if not chunks:
+        return None
+    for column in chunks[0].columns:
+        if isinstance(chunks[0][column].dtype, pd.CategoricalDtype):
+            categories = pd.api.types.union_categoricals([chunk[column] for chunk in chunks], ignore_order=True).categories
+            for chunk in chunks:
+                chunk[column] = chunk[column].cat.set_categories(categories)
+    return pd.concat(chunks)
+
+# CSV statements named by a file, a directory of exports or a glob pattern, in name order
+def statement_files(source):
+    if os.path.isfile(source):
+        return [source]
+    if os.path.isdir(source):
+        return sorted(glob.glob(os.path.join(source, '*.csv')))
+    return sorted(path for path in glob.glob(source) if os.path.isfile(path))
+
+def statement_path(csv_path, end=None):
+    return os.path.join(STATEMENT_DIRECTORY, f'{file_hash(csv_path, end)}-v{STATEMENT_FORMAT_VERSION}.parquet')
+
+# Convert a CSV statement, or its first `end` bytes, to typed Parquet unless
+# that content was already converted
+def ingest_statement(csv_path, end=None):
+    path = statement_path(csv_path, end)
+    if not os.path.exists(path):
+        os.makedirs(STATEMENT_DIRECTORY, exist_ok=True)
+        write_statement_chunks(read_statement_chunks(csv_path, end=end), path)
+    return path
+
+# Convert several CSV statements, or the first `ends` bytes of each, to typed
+# Parquet, in parallel on a process pool, then remove the least recently
+# converted others beyond STATEMENTS_KEPT
+def ingest_statements(csv_paths, workers=INGEST_WORKERS, ends=None):
+    ends = [None] * len(csv_paths) if ends is None else ends
+    pending = [(path, end) for path, end in zip(csv_paths, ends) if not os.path.exists(statement_path(path, end))]
+    # Without fork (see workers.py), statements are converted one after another below
+    if len(pending) > 1 and can_fork():
+        with fork_pool(min(workers or os.cpu_count(), len(pending))) as pool:
+            list(pool.map(ingest_statement, *zip(*pending)))
+    paths = [ingest_statement(path, end) for path, end in zip(csv_paths, ends)]
+    others = set(glob.glob(os.path.join(STATEMENT_DIRECTORY, '*.parquet'))) - set(paths)
+    remove_oldest(others, max(STATEMENTS_KEPT - len(set(paths)), 0))
+    return paths
+
+# Typed statement, reading only the given columns from disk
+def load_statement(path, columns=None):
+    return pd.read_parquet(path, columns=columns)
+
+# Typed statement in chunks of at most `chunk_rows` rows, reading only the given columns from disk;
+# rows are labelled by their position in the statement, as in load_statement, plus `offset`
+def iter_statement(path, columns=None, chunk_rows=STATEMENT_CHUNK_ROWS, offset=0):
+    for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_rows, columns=columns):
+        chunk = batch.to_pandas()
+        chunk.index = pd.RangeIndex(offset, offset + len(chunk))
+        offset += len(chunk)
+        yield chunk
+
+def first_transaction_date(path):
+    return pd.read_parquet(path, columns=['transaction_date'])['transaction_date'].min()
+
+# Several typed statements as one stream of chunks, the statement with the
+# earliest transaction first; rows are labelled by their position in that stream
+def iter_statements(paths, columns=None, chunk_rows=STATEMENT_CHUNK_ROWS):
+    offset = 0
+    for path in sorted(paths, key=first_transaction_date):
+        yield from iter_statement(path, columns, chunk_rows, offset)
+        offset += pq.ParquetFile(path).metadata.num_rows
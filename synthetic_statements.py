@@ -0,0 +1,159 @@
+# Synthetic bank statements in the merged_data.csv export format
+#
+# Descriptions follow the mix seen in real exports: mostly UPI transfers to
+# people and merchants, card purchases (PCD/PCI), payment gateways, NEFT, IMPS
+# and mobile banking transfers, ATM withdrawals, refunds and card fees. Dates
+# use dd/mm/yyyy until July 2024 and dd-mm-yyyy from then on, as the bank's
+# exports do, and amounts of 1,000 or more carry thousands separators.
+#
+# usage: python synthetic_statements.py ROWS OUTPUT.csv [--seed N]
+import argparse
+
+import numpy as np
+import pandas as pd
+
+# Rows generated and written at a time
+GENERATE_CHUNK_ROWS = 500_000
+
+# First transaction date of a synthetic statement, and the days its transactions
+# spread over at most; larger statements get more transactions per day
+START_DATE = '2018-08-21'
+SPAN_DAYS = 2200
+
+# Exports switch from slashes to dashes in dates from this day
+DASHED_DATES_FROM = pd.Timestamp('2024-07-01')
+
+# Counterparties, drawn with a long tail so descriptions repeat like real ones
+MERCHANTS = [
+    'ZOMATO MEDIA PR', 'Swiggy', 'BUNDL TECHNOLOG', 'Balaji Supermar', 'NEEDS SUPERMART', 'Paytm', 'amazon@apl',
+    'googlepay@a', 'BHARAT PETROLEU', 'HPCL AUTO CARE', 'Vendiman', 'BLINKIT', 'ZEPTO MARKETPLA', 'DMRC LTD',
+    'UBER INDIA SYST', 'OLA CABS', 'IRCTC', 'Airtel', 'Jio Prepaid', 'NETFLIX', 'Spotify', 'BIGBASKET',
+    'DOMINOS PIZZA', 'Bagril Store', 'MAKEMYTRIP', 'APOLLO PHARMACY', 'DECATHLON', 'CULT FIT',
+]
+PEOPLE = [
+    'VANDANA CHAWLA', 'HITESH BHAGAT', 'SONU  AHIRWAR', 'GIRRAJ GURJAR', 'YAWAR RASHID', 'NATHUNI  MANDAL',
+    'KANISHQ SHARMA', 'PAWAN KUMAR', 'VYOM DEEPANSH', 'RAHUL VERMA', 'PRIYA SINGH', 'AMIT GUPTA', 'NEHA JAIN',
+    'SURESH YADAV', 'DEEPAK MEHTA', 'ANJALI RAO', 'MOHIT ARORA', 'KAVITA NAIR', 'ROHIT KAPOOR', 'SNEHA IYER',
+]
+CARD_MERCHANTS = [
+    'Amazon Pay', 'ONE97 COMMUNICATIONS L', 'HPCL AUTO CARE CENTER_', 'FUEL JUNCTION', 'GOOGLE*COLAB',
+    'PHONEPE WALLET', 'BIG BAZAAR', 'RELIANCE RETAIL', 'FLIPKART INTERNET', 'YouTube Premium',
+]
+CITIES = ['NEW DELHI', 'NOIDA', 'GURGAON', 'MUMBAI', 'BANGALORE']
+UPI_NOTES = ['UPI', 'Payment from Ph', 'NA', 'UPI Transaction', 'You are pay', 'Refund for', 'Money']
+
+# Description kinds and their share of rows
+KINDS = {
+    'upi_person': 0.28,
+    'upi_merchant': 0.32,
+    'card': 0.28,
+    'gateway': 0.02,
+    'neft': 0.02,
+    'salary': 0.01,
+    'imps': 0.03,
+    'atm': 0.02,
+    'refund': 0.01,
+    'card_fee': 0.01,
+}
+
+
+def digits(rng, count, length):
+    return rng.integers(10 ** (length - 1), 10 ** length, count).astype(str).astype(object)
+
+# Counterparty indexes with a Zipf-like tail, so a few counterparties dominate
+def zipf_choice(rng, values, count):
+    weights = 1 / np.arange(1, len(values) + 1)
+    return np.asarray(values, dtype=object)[rng.choice(len(values), count, p=weights / weights.sum())]
+
+# Descriptions, Chq / Ref No. values and credit flags of `count` transactions
+def generate_descriptions(rng, count, dates):
+    kinds = rng.choice(list(KINDS), count, p=np.array(list(KINDS.values())) / sum(KINDS.values()))
+    descriptions = np.empty(count, dtype=object)
+    references = np.empty(count, dtype=object)
+    credits = np.zeros(count, dtype=bool)
+    stamps = dates.strftime('%d%m%y').to_numpy(dtype=object)
+    times = rng.integers(0, 24, count).astype(str).astype(object) + ':' + rng.integers(10, 60, count).astype(str).astype(object)
+
+    def fill(kind, make_description, make_reference, credit=False):
+        rows = np.flatnonzero(kinds == kind)
+        descriptions[rows] = make_description(rows, len(rows))
+        references[rows] = make_reference(rows, len(rows))
+        credits[rows] = credit
+
+    fill('upi_person', lambda rows, n: 'UPI/' + zipf_choice(rng, PEOPLE, n) + '/' + digits(rng, n, 12) + '/' + zipf_choice(rng, UPI_NOTES, n),
+         lambda rows, n: 'UPI-' + digits(rng, n, 12))
+    fill('upi_merchant', lambda rows, n: 'UPI/' + zipf_choice(rng, MERCHANTS, n) + '/' + digits(rng, n, 12) + '/' + zipf_choice(rng, UPI_NOTES, n),
+         lambda rows, n: 'UPI-' + digits(rng, n, 12))
+    fill('card', lambda rows, n: rng.choice(['PCD', 'PCI'], n, p=[0.9, 0.1]).astype(object) + '/1186/' + zipf_choice(rng, CARD_MERCHANTS, n) + '/' + zipf_choice(rng, CITIES, n) + stamps[rows] + '/' + times[rows],
+         lambda rows, n: digits(rng, n, 11))
+    fill('gateway', lambda rows, n: 'PG ' + zipf_choice(rng, ['ZOMATO LIMITED', 'AMAZON PAY INDIA PRI', 'SWIGGY', 'IRCTC'], n),
+         lambda rows, n: 'KPG-' + digits(rng, n, 10))
+    fill('neft', lambda rows, n: 'NEFT ' + digits(rng, n, 10) + ' ' + zipf_choice(rng, PEOPLE, n) + ' ICIC0SF0002',
+         lambda rows, n: 'NEFTINW-' + digits(rng, n, 10), credit=True)
+    fill('salary', lambda rows, n: np.full(n, 'NEFT 20BQH0002LUH0359 COGNIZANT TECHNOLOGY SOLUTIO', dtype=object),
+         lambda rows, n: 'NEFTINW-' + digits(rng, n, 10), credit=True)
+    fill('imps', lambda rows, n: rng.choice(['IBIMPS Sent to ', 'MB SENT TO '], n).astype(object) + zipf_choice(rng, ['Hitesh', 'Vish', 'Kanish', 'Kan'], n) + ' ' + digits(rng, n, 12) + ' Ref ' + digits(rng, n, 12),
+         lambda rows, n: 'IMPS-' + digits(rng, n, 12))
+    fill('atm', lambda rows, n: 'ATL/1186/' + digits(rng, n, 6) + '/' + zipf_choice(rng, ['SBI DLF PHASE IV GURGA', '+BADARPURDELHIDLIN'], n) + stamps[rows] + '/' + times[rows],
+         lambda rows, n: digits(rng, n, 11))
+    fill('refund', lambda rows, n: 'VISA-REFUND/' + stamps[rows] + '/0291/' + zipf_choice(rng, CARD_MERCHANTS, n),
+         lambda rows, n: digits(rng, n, 11), credit=True)
+    fill('card_fee', lambda rows, n: 'DEBIT CARD ANNUAL FEE XXXX1186 FOR ' + dates[rows].strftime('%Y').to_numpy(dtype=object),
+         lambda rows, n: 'MB-' + digits(rng, n, 7))
+    return descriptions, references, credits
+
+# Dates as the exports write them: slashes, then dashes from DASHED_DATES_FROM
+def format_dates(dates):
+    slashed = dates.strftime('%d/%m/%Y').to_numpy(dtype=object)
+    dashed = dates.strftime('%d-%m-%Y').to_numpy(dtype=object)
+    return np.where(dates >= DASHED_DATES_FROM, dashed, slashed)
+
+# Money as the exports write it: '500', '234.82', '1,000.00'
+def format_money(values):
+    plain = pd.Series(values).map('{:g}'.format)
+    grouped = pd.Series(values).map('{:,.2f}'.format)
+    return np.where(values >= 1000, grouped, plain)
+
+# One chunk of a statement in the export's columns, continuing from `first_number`, `first_date` and `balance`;
+# each transaction moves to the next day with probability `next_day`
+def generate_chunk(rng, rows, first_number, first_date, balance, next_day):
+    dates = first_date + pd.to_timedelta(np.cumsum(rng.random(rows) < next_day), unit='D')
+    value_dates = dates - pd.to_timedelta((rng.random(rows) < 0.1).astype('int64'), unit='D')
+    descriptions, references, credits = generate_descriptions(rng, rows, dates)
+
+    amounts = np.round(np.exp(rng.normal(5, 1.6, rows)), 2).clip(0.25, 97540)
+    amounts[credits] = np.round(amounts[credits] * 20, 2).clip(max=250000)
+    balances = np.round(np.abs(balance + np.cumsum(np.where(credits, amounts, -amounts))), 2)
+
+    chunk = pd.DataFrame({
+        'Sl. No.': np.arange(first_number, first_number + rows),
+        'Transaction Date': format_dates(dates),
+        'Value Date': format_dates(value_dates),
+        'Description': descriptions,
+        'Chq / Ref No.': references,
+        'Amount': format_money(amounts),
+        'Dr / Cr': np.where(credits, 'CR', 'DR'),
+        'Balance': format_money(balances),
+        'Dr / Cr.1': 'CR',
+    })
+    return chunk, dates[-1], balances[-1]
+
+# Write a statement of `rows` transactions to `path`, generating it in chunks
+def write_statement(path, rows, seed=0):
+    rng = np.random.default_rng(seed)
+    first_date = pd.Timestamp(START_DATE)
+    balance = 50_000.0
+    next_day = min(0.4, SPAN_DAYS / max(rows, 1))
+    for first in range(0, rows, GENERATE_CHUNK_ROWS):
+        chunk, first_date, balance = generate_chunk(rng, min(GENERATE_CHUNK_ROWS, rows - first), first + 1, first_date, balance, next_day)
+        chunk.to_csv(path, mode='w' if first == 0 else 'a', header=first == 0, index=False)
+    return path
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Write a synthetic statement in the merged_data.csv format.')
+    parser.add_argument('rows', type=int, help='number of transactions')
+    parser.add_argument('output', help='CSV file to write')
+    parser.add_argument('--seed', type=int, default=0, help='random seed; the same seed gives the same statement')
+    args = parser.parse_args()
+    write_statement(args.output, args.rows, args.seed)
@@ -0,0 +1,35 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import caching
+import pipeline
+import storage
+from indexes import transaction_indexes
+from rollups import rollup_cubes
+from search import search_indexes
+
+# The sample export shipped with the app
+SAMPLE_EXPORT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'merged_data.csv')
+
+
+# Header and rows of the sample export, as lines ending with a newline
+@pytest.fixture(scope='session')
+def export_lines():
+    with open(SAMPLE_EXPORT, newline='') as file:
+        return file.read().splitlines(keepends=True)
+
+
+# Statements cached under a temporary directory, with nothing kept in memory
+@pytest.fixture(autouse=True)
+def cache_directories(tmp_path, monkeypatch):
+    monkeypatch.setattr(storage, 'STATEMENT_DIRECTORY', str(tmp_path / 'cache' / 'statements'))
+    monkeypatch.setattr(caching, 'APPENDED_DIRECTORY', str(tmp_path / 'cache' / 'appended'))
+    for cache in (pipeline.enriched_frames, transaction_indexes, search_indexes, rollup_cubes):
+        cache.clear()
+    yield
+    for cache in (pipeline.enriched_frames, transaction_indexes, search_indexes, rollup_cubes):
+        cache.clear()
@@ -0,0 +1,122 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import pipeline
+from indexes import TransactionIndex, transaction_index, transaction_indexes
+from pipeline import append_statements, enrich_statements
+from rollups import CUBE_DIMENSIONS, RollupCube, rollup_cube, rollup_cubes
+from search import SearchIndex, search_index, search_indexes
+
+
+def write_export(path, text, mode='w'):
+    with open(path, mode, newline='') as file:
+        file.write(text)
+
+# Frames holding the same rows in the same order, whatever categories they saw
+def assert_same_rows(data, expected):
+    pd.testing.assert_frame_equal(data.reset_index(drop=True), expected.reset_index(drop=True), check_categorical=False)
+
+
+# A line caught mid-write is left alone until its newline arrives, also across a restart
+@pytest.mark.parametrize('field', ['balance', 'dr_cr'])
+def test_partial_line_is_read_once_complete(tmp_path, export_lines, field):
+    path = tmp_path / 'export.csv'
+    write_export(path, ''.join(export_lines[:31]))
+    key, data = append_statements(str(path))
+    assert len(data) == 30
+
+    line = export_lines[31]
+    # Cut inside the balance, or before the Dr / Cr column
+    commas = [position for position, character in enumerate(line) if character == ',']
+    cut = commas[-2] + 2 if field == 'balance' else commas[-3] + 1
+    write_export(path, line[:cut], 'a')
+    partial_key, data = append_statements(str(path))
+    assert (partial_key, len(data)) == (key, 30)
+    pipeline.enriched_frames.clear()
+    partial_key, data = append_statements(str(path))
+    assert (partial_key, len(data)) == (key, 30)
+
+    write_export(path, line[cut:], 'a')
+    key, data = append_statements(str(path))
+    assert len(data) == 31
+    assert_same_rows(data, enrich_statements([str(path)]))
+
+# An export first read while a line is being written is watermarked before that line
+def test_first_read_stops_before_partial_line(tmp_path, export_lines):
+    path = tmp_path / 'export.csv'
+    line = export_lines[31]
+    write_export(path, ''.join(export_lines[:31]) + line[:-6])
+    key, data = append_statements(str(path))
+    assert len(data) == 30
+
+    write_export(path, line[-6:], 'a')
+    key, data = append_statements(str(path))
+    assert len(data) == 31
+    assert_same_rows(data, enrich_statements([str(path)]))
+
+
+# Same positions from a slice or an array of positions
+def positions(rows):
+    return np.arange(rows.start, rows.stop) if isinstance(rows, slice) else np.asarray(rows)
+
+# Indexes, search index and rollup cube of `data` answering as those built from scratch
+def assert_same_structures(key, data):
+    index, search, cube = transaction_index(key, data), search_index(key, data), rollup_cube(key, data)
+    fresh_index, fresh_search, fresh_cube = TransactionIndex(data), SearchIndex(data), RollupCube(data)
+
+    dates = data['transaction_date']
+    ranges = [{'transaction_date': (dates.iloc[len(data) // 3], dates.iloc[-1])}, {'amount': (100, 5000)},
+              {'balance': (None, 20000), 'credit_debit_value': (-1, -1)}]
+    for bounds in ranges:
+        np.testing.assert_array_equal(positions(index.rows(**bounds)), positions(fresh_index.rows(**bounds)))
+    for column in ['transaction_names', 'transaction_category', 'amount']:
+        np.testing.assert_array_equal(index.sort_key(data, column), fresh_index.sort_key(data, column))
+
+    within = index.rows(amount=(None, 10000))
+    for query in ['upi', 'zomato', 'salary credit', 'food', '"neft"']:
+        np.testing.assert_array_equal(positions(search.rows(query)), positions(fresh_search.rows(query)))
+        np.testing.assert_array_equal(positions(search.rows(query, within)), positions(fresh_search.rows(query, within)))
+    rows, similarity = search.similar_rows('zomto', within)
+    fresh_rows, fresh_similarity = fresh_search.similar_rows('zomto', within)
+    np.testing.assert_array_equal(rows, fresh_rows)
+    np.testing.assert_allclose(similarity, fresh_similarity)
+
+    months = slice(len(data) // 4, len(data) - 7)
+    for dimensions in [['transaction_category'], ['transaction_month', 'transaction_names'], CUBE_DIMENSIONS]:
+        pd.testing.assert_frame_equal(cube.rollup(cube.totals, dimensions), fresh_cube.rollup(fresh_cube.totals, dimensions))
+        pd.testing.assert_frame_equal(cube.rollup(cube.row_totals(months), dimensions),
+                                      fresh_cube.rollup(fresh_cube.row_totals(months), dimensions))
+        pd.testing.assert_frame_equal(cube.rollup(cube.row_totals(positions(within)), dimensions),
+                                      fresh_cube.rollup(fresh_cube.row_totals(positions(within)), dimensions))
+
+
+# Changes to a directory of exports after its first load, and whether the structures are extended for them
+APPENDS = {
+    'in_order': (lambda lines: {'a.csv': lines[:3001] + lines[3001:3201]}, True),
+    'new_file': (lambda lines: {'a.csv': lines[:3001], 'b.csv': lines[:1] + lines[3001:3201]}, True),
+    'backdated': (lambda lines: {'a.csv': lines[:3001] + lines[3001:3101] + lines[2001:2011]}, False),
+    'rewritten': (lambda lines: {'a.csv': lines[:10] + lines[11:3001]}, False),
+}
+
+# Statements appended to, or rewritten, give the rows, indexes, search index
+# and rollup cube of enriching them from scratch
+@pytest.mark.parametrize('change', list(APPENDS))
+def test_incremental_structures_match_rebuild(tmp_path, export_lines, change):
+    directory = tmp_path / 'statements'
+    directory.mkdir()
+    write_export(directory / 'a.csv', ''.join(export_lines[:3001]))
+    key, data = append_statements(str(directory))
+    assert_same_structures(key, data)
+
+    exports, extended = APPENDS[change]
+    for name, lines in exports(export_lines).items():
+        write_export(directory / name, ''.join(lines))
+    new_key, new_data = append_statements(str(directory))
+    assert new_key != key
+    assert all((cache.get(new_key) is not None) == extended for cache in (transaction_indexes, search_indexes, rollup_cubes))
+
+    assert_same_rows(new_data, enrich_statements(sorted(str(path) for path in directory.iterdir())))
+    assert_same_structures(new_key, new_data)
+    # Sessions still on the first version keep its answers
+    assert_same_structures(key, data)
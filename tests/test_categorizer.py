@@ -0,0 +1,71 @@
+import os
+import re
+import shutil
+
+import pytest
+
+import categorizer
+from categorizer import RuleTable
+
+
+# Rules that compile on their own but not as one alternation fail when the table is built
+def test_rules_that_cannot_be_combined_are_rejected():
+    with pytest.raises(re.error):
+        RuleTable({'Foo': '(?P<w>foo)', 'Bar': '(?P<w>bar)'})
+    with pytest.raises(re.error):
+        RuleTable({'Foo': '(?P<rule1>foo)', 'Bar': 'bar'})
+
+
+@pytest.mark.parametrize('pattern', [r'(a)\1', r'(?P<x>a)(?P=x)', r'(a)?(?(1)b|c)'])
+def test_backreferences_are_rejected(pattern):
+    with pytest.raises(re.error):
+        RuleTable({'Other': 'other', 'Repeated': pattern})
+
+
+# The combined alternation finds the rule the sequential loop would
+def test_combined_match_keeps_rule_priority():
+    table = RuleTable({f'Rule{index}': f'\\b(word{index})\\b' for index in range(10)} | {'Any': r'\bword'})
+    assert table.match('a word5 and word2') == 'Rule2'
+    assert table.match('wordy') == 'Any'
+    assert table.match('nothing') == 'Other'
+
+
+# Rule files copied to a temporary directory, as the loaded rules
+@pytest.fixture
+def rule_directory(tmp_path, monkeypatch):
+    for file_name, _ in categorizer.RULE_FILES.values():
+        shutil.copy(os.path.join(categorizer.RULES_DIRECTORY, file_name), tmp_path / file_name)
+    monkeypatch.setattr(categorizer, 'RULES_DIRECTORY', str(tmp_path))
+    monkeypatch.setattr(categorizer, 'rule_tables', dict(categorizer.rule_tables))
+    monkeypatch.setattr(categorizer, 'rule_file_stats', {name: categorizer.rule_file_stat(name) for name in categorizer.RULE_FILES})
+    yield tmp_path
+    # Drop what was classified by the edited rules
+    categorizer.enrichment_cache.clear()
+    categorizer.categorize_buckets.cache_clear()
+
+def edit_rules(path, text):
+    with open(path, 'a', newline='') as file:
+        file.write(text)
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+
+# A rule edit that can't be matched raises ValueError and keeps the previous rules, until it is fixed
+def test_invalid_rule_edit_keeps_previous_rules(rule_directory):
+    names = categorizer.rule_tables['names']
+    edit_rules(rule_directory / 'patterns.csv', '\nFoo,(?P<w>foo)\nBar,(?P<w>bar)')
+    with pytest.raises(ValueError):
+        categorizer.reload_rules()
+    assert categorizer.rule_tables['names'] is names
+    assert categorizer.classify('UPI/a foo and bar payment').transaction_names != 'Foo'
+
+    edit_rules(rule_directory / 'patterns.csv', '\nBaz,(baz)')
+    with pytest.raises(ValueError):
+        categorizer.reload_rules()
+
+    with open(rule_directory / 'patterns.csv', newline='') as file:
+        content = file.read().replace('(?P<w>foo)', '(foo)').replace('(?P<w>bar)', '(bar)')
+    with open(rule_directory / 'patterns.csv', 'w', newline='') as file:
+        file.write(content)
+    assert categorizer.reload_rules() == {'names': {'Foo', 'Bar', 'Baz'}}
+    assert categorizer.rule_tables['names'].match('a bar payment') == 'Bar'
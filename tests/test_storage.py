@@ -0,0 +1,17 @@
+import os
+
+import storage
+from storage import ingest_statements, load_statement
+
+
+# Older conversions of a rewritten export are removed beyond STATEMENTS_KEPT, never the current one
+def test_superseded_statements_are_removed(tmp_path, export_lines, monkeypatch):
+    monkeypatch.setattr(storage, 'STATEMENTS_KEPT', 2)
+    path = tmp_path / 'export.csv'
+    for rows in range(10, 60, 10):
+        path.write_text(''.join(export_lines[:rows + 1]))
+        [converted] = ingest_statements([str(path)])
+        # Number the conversions in order, as they can share a modification time
+        os.utime(converted, (rows, rows))
+        assert len(load_statement(converted)) == rows
+        assert len(os.listdir(storage.STATEMENT_DIRECTORY)) <= 2
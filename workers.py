@@ -0,0 +1,19 @@
+# Process pools for the work that is spread over cores: converting statements
+# (see storage.ingest_statements) and classifying descriptions (see
+# categorizer.classify_parallel)
+#
+# Workers are forked: Streamlit runs the app as __main__, so spawned workers
+# would run the whole app again on start. Where fork isn't available, callers
+# do the work in their own process instead.
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+
+# Whether worker processes can be forked on this platform
+def can_fork():
+    return 'fork' in multiprocessing.get_all_start_methods()
+
+# Pool of `workers` forked processes, each running `initializer(*initargs)` once on start
+def fork_pool(workers, initializer=None, initargs=()):
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('fork'),
+                               initializer=initializer, initargs=initargs)